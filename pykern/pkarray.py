@@ -10,13 +10,450 @@ from __future__ import absolute_import, division, print_function
 from future.utils import bytes_to_native_str
 
 import array
+import errno
+import io
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import weakref
+
+from pykern import pkplatform
 
 #: Future-proof typecode for double
-DOUBLE_TYPECODE = bytes_to_native_str('d')
+DOUBLE_TYPECODE = bytes_to_native_str(b'd')
 
 #: Future-proof typecode for float
 FLOAT_TYPECODE = bytes_to_native_str(b'f')
 
+#: Typecode for 32-bit signed int (int or long, depending on platform)
+INT32_TYPECODE = [c for c in 'ilh' if array.array(c).itemsize == 4][0]
+
+#: Typecode for 64-bit signed int (long or long long, depending on platform)
+INT64_TYPECODE = [c for c in 'lq' if array.array(c).itemsize == 8][0]
+
+#: Bytes added to a `MappedArray` file when it is full (rounded to a multiple)
+MAPPED_GROW_BYTES = 1 << 24
+
+#: Identifies `MappedArray` files
+MAPPED_MAGIC = b'PKARRAY\0'
+
+#: Maximum number of dimensions of a `MappedArray` row
+MAPPED_MAX_ROW_DIMS = 4
+
+#: Incremented when the `MappedArray` file format changes
+MAPPED_VERSION = 1
+
+#: Identifies `SharedArray` segments
+SHARED_MAGIC = b'PKSHARE\0'
+
+#: Maximum number of dimensions of a `SharedArray`
+SHARED_MAX_DIMS = 4
+
+#: Typecode for unsigned bytes
+UINT8_TYPECODE = bytes_to_native_str(b'B')
+
+#: magic, version, typecode, row ndim, length (rows), row shape
+_MAPPED_HEADER = struct.Struct('<8sIcB2xQ{}Q'.format(MAPPED_MAX_ROW_DIMS))
+
+#: Data starts here so elements are aligned
+_MAPPED_DATA = 64
+
+#: Offset of length in header, which is updated after rows are written
+_MAPPED_LENGTH = struct.Struct('<Q')
+_MAPPED_LENGTH_OFFSET = 16
+
+#: magic, typecode, ndim, references, shape
+_SHARED_HEADER = struct.Struct('<8scB2xI{}Q'.format(SHARED_MAX_DIMS))
+
+#: Data starts here so elements are aligned
+_SHARED_DATA = 64
+
+#: Offset of references in header, which is updated under flock
+_SHARED_REFS = struct.Struct('<I')
+_SHARED_REFS_OFFSET = 12
+
+
+class MappedArray(object):
+    """Array of rows in a memory-mapped file which may be larger than memory
+
+    The file has a `_MAPPED_DATA` byte header (magic, version,
+    typecode, length, row shape) followed by the rows in machine
+    order. Create with `open_mapped`.
+
+    A single writer (enforced with flock) appends rows. The file is
+    grown by `MAPPED_GROW_BYTES` and remapped, so appends are
+    amortized. The length in the header is updated after the rows are
+    written so readers in other processes never see partial rows; they
+    see new rows after `refresh` or when they index past the rows
+    they have mapped.
+
+    Indexing a row (or, for scalar rows, an element) returns the
+    element or a memoryview of the row. Slices (step 1) return a
+    memoryview shaped (rows,) + row_shape, or an empty one-dimensional
+    memoryview if there are no rows. Views stay valid after the
+    file is remapped or closed, until they are released.
+
+    Mode "w" replaces an existing file with a new one (rename) rather
+    than truncating it, because readers which have it mapped would
+    fault on the truncated pages.
+
+    Args:
+        filename (str or py.path): file to map
+        mode (str): "r" read-only, "a" append (create if missing), "w" create or replace
+        typecode (str): type of elements for new files [DOUBLE_TYPECODE]
+        row_shape (tuple): shape of each row for new files [()]
+    """
+
+    def __init__(self, filename, mode='r', typecode=DOUBLE_TYPECODE, row_shape=()):
+        assert mode in ('a', 'r', 'w'), \
+            '{}: mode must be a, r, or w'.format(mode)
+        assert len(row_shape) <= MAPPED_MAX_ROW_DIMS, \
+            '{}: row_shape may have at most {} dimensions'.format(row_shape, MAPPED_MAX_ROW_DIMS)
+        self.filename = str(filename)
+        self.writable = mode != 'r'
+        self._mmap = None
+        if mode == 'r':
+            self._fd = os.open(self.filename, os.O_RDONLY)
+        else:
+            self._fd = _mapped_lock(self.filename)
+        try:
+            if mode == 'w' and os.fstat(self._fd).st_size:
+                f = self._fd
+                self._fd = _mapped_replace(self.filename, f)
+                os.close(f)
+            n = os.fstat(self._fd).st_size
+            if n == 0 and self.writable:
+                r = tuple(row_shape) + (0,) * (MAPPED_MAX_ROW_DIMS - len(row_shape))
+                os.write(
+                    self._fd,
+                    _MAPPED_HEADER.pack(
+                        MAPPED_MAGIC,
+                        MAPPED_VERSION,
+                        typecode.encode('ascii'),
+                        len(row_shape),
+                        0,
+                        *r
+                    ).ljust(_MAPPED_DATA, b'\0'),
+                )
+            elif n < _MAPPED_DATA:
+                raise ValueError('{}: missing MappedArray header'.format(self.filename))
+            self._remap()
+            h = _MAPPED_HEADER.unpack_from(self._mmap, 0)
+            if h[0] != MAPPED_MAGIC or h[1] != MAPPED_VERSION:
+                raise ValueError(
+                    '{}: not a MappedArray version {} file'.format(self.filename, MAPPED_VERSION),
+                )
+        except Exception:
+            self.close()
+            raise
+        self.typecode = h[2].decode('ascii')
+        self.row_shape = tuple(h[5:5 + h[3]])
+        self.itemsize = array.array(self.typecode).itemsize
+        self._row_items = 1
+        for x in self.row_shape:
+            self._row_items *= x
+        self._row_bytes = self.itemsize * self._row_items
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, key):
+        n = len(self)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            assert step == 1, \
+                '{}: slice step must be 1'.format(step)
+            v = self._view(start, max(start, stop))
+            if stop <= start:
+                # memoryview does not allow zeros in shape
+                return v.cast(self.typecode)
+            return v.cast(self.typecode, (stop - start,) + self.row_shape)
+        if key < 0:
+            key += n
+        if not 0 <= key < n:
+            raise IndexError('{}: index out of range'.format(key))
+        v = self._view(key, key + 1)
+        if not self.row_shape:
+            return v.cast(self.typecode)[0]
+        return v.cast(self.typecode, self.row_shape)
+
+    def __len__(self):
+        return _MAPPED_LENGTH.unpack_from(self._mmap, _MAPPED_LENGTH_OFFSET)[0]
+
+    def append(self, value):
+        """Append one row
+
+        Args:
+            value (object): number (scalar rows) or row elements
+        """
+        self.extend([value] if not self.row_shape else value)
+
+    def close(self):
+        """Unmap and close file (views remain valid until released)"""
+        if self._mmap is not None:
+            self._flush()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def extend(self, values):
+        """Append rows
+
+        bytes and bytearray are appended as is. Buffers (e.g.
+        array.array) whose elements are not `typecode` are converted.
+
+        Args:
+            values (object): bytes, buffer, or iterable of elements (rows flattened)
+        """
+        assert self.writable, \
+            '{}: opened read-only'.format(self.filename)
+        b = _typed_bytes(values, self.typecode)
+        if b.nbytes % self._row_bytes:
+            raise ValueError(
+                '{} bytes: not a multiple of row size {}'.format(b.nbytes, self._row_bytes),
+            )
+        n = len(self)
+        o = _MAPPED_DATA + n * self._row_bytes
+        e = o + b.nbytes
+        if e > len(self._mmap):
+            os.ftruncate(
+                self._fd,
+                _MAPPED_DATA + (e - _MAPPED_DATA + MAPPED_GROW_BYTES - 1)
+                // MAPPED_GROW_BYTES * MAPPED_GROW_BYTES,
+            )
+            self._remap()
+        self._mmap[o:e] = b
+        # Publish after the rows are written
+        _MAPPED_LENGTH.pack_into(
+            self._mmap,
+            _MAPPED_LENGTH_OFFSET,
+            n + b.nbytes // self._row_bytes,
+        )
+
+    def flush(self):
+        """Write dirty pages to the file"""
+        self._flush()
+
+    def refresh(self):
+        """Map rows appended by another process"""
+        self._remap()
+
+    @property
+    def shape(self):
+        """tuple: (rows,) + row_shape"""
+        return (len(self),) + self.row_shape
+
+    def to_numpy(self):
+        """View all rows as a numpy array without copying
+
+        Returns:
+            numpy.ndarray: shaped (rows,) + row_shape
+        """
+        import numpy
+
+        return numpy.frombuffer(self[:], dtype=self.typecode).reshape(
+            (-1,) + self.row_shape,
+        )
+
+    def _flush(self):
+        if self.writable:
+            self._mmap.flush()
+
+    def _remap(self):
+        # The old map is not closed so views of it remain valid
+        self._mmap = mmap.mmap(
+            self._fd,
+            0,
+            access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ,
+        )
+
+    def _view(self, start, stop):
+        e = _MAPPED_DATA + stop * self._row_bytes
+        if e > len(self._mmap):
+            self._remap()
+        return memoryview(self._mmap)[_MAPPED_DATA + start * self._row_bytes:e]
+
+
+class SharedArray(object):
+    """Array in POSIX shared memory which can be passed to other processes
+
+    Create with `new_shared` and attach in other processes with
+    `attach_shared` by `name`. Pickling only passes the name, so a
+    SharedArray can be an argument to `multiprocessing` or
+    `concurrent.futures` pools without copying the elements.
+
+    The segment holds a count of handles in all processes. `close`
+    (also called when the handle is garbage collected or at exit)
+    decrements the count and the last handle unlinks the segment.
+    Views (e.g. `to_numpy`) must be released before `close`, or the
+    memory stays mapped until the process exits.
+
+    A process which exits without closing its handles (crashes, is
+    killed, or calls `os._exit`) leaves its references in the count,
+    so the segment is not unlinked, and it stays in memory until
+    reboot. The creator should call `unlink` when the other processes
+    are done (e.g. after the pool exits) if they may have died.
+
+    Indexing is on the flattened elements; `shape` is used by `to_numpy`.
+
+    Args:
+        name (str): segment to attach or None to create
+        shape (tuple): dimensions when creating
+        typecode (str): type of elements when creating
+    """
+
+    def __init__(self, name=None, shape=None, typecode=DOUBLE_TYPECODE):
+        from multiprocessing import shared_memory
+
+        if name is None:
+            assert len(shape) <= SHARED_MAX_DIMS, \
+                '{}: shape may have at most {} dimensions'.format(shape, SHARED_MAX_DIMS)
+            self._shm, self._untracked = _shared_memory(
+                shared_memory,
+                create=True,
+                size=_SHARED_DATA + array.array(typecode).itemsize * _product(shape),
+            )
+            _SHARED_HEADER.pack_into(
+                self._shm.buf,
+                0,
+                SHARED_MAGIC,
+                typecode.encode('ascii'),
+                len(shape),
+                0,
+                *(tuple(shape) + (0,) * (SHARED_MAX_DIMS - len(shape)))
+            )
+        else:
+            self._shm, self._untracked = _shared_memory(shared_memory, name=name)
+        h = _SHARED_HEADER.unpack_from(self._shm.buf, 0)
+        if h[0] != SHARED_MAGIC:
+            _shared_release(self._shm, None, self._untracked, False)
+            raise ValueError('{}: not a SharedArray'.format(name))
+        self.name = self._shm.name
+        self.typecode = h[1].decode('ascii')
+        self.shape = tuple(h[4:4 + h[2]])
+        _shared_refs(self._shm, 1, create=name is None)
+        # segment may be rounded up to a page
+        self._view = self._shm.buf[_SHARED_DATA:].cast(self.typecode)[:_product(self.shape)]
+        self._finalizer = weakref.finalize(
+            self,
+            _shared_release,
+            self._shm,
+            self._view,
+            self._untracked,
+            True,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, key):
+        return self._view[key]
+
+    def __len__(self):
+        return len(self._view)
+
+    def __reduce__(self):
+        return (attach_shared, (self.name,))
+
+    def __setitem__(self, key, value):
+        self._view[key] = value
+
+    def close(self):
+        """Release this handle and unlink the segment if it is the last one"""
+        self._finalizer()
+
+    def unlink(self):
+        """Unlink the segment regardless of references
+
+        Existing handles remain valid until they are closed, but the
+        segment can no longer be attached.
+        """
+        _shared_unlink(self._shm, self._untracked)
+
+    def to_numpy(self):
+        """View elements as a numpy array without copying
+
+        Returns:
+            numpy.ndarray: shaped like `shape`
+        """
+        import numpy
+
+        return numpy.frombuffer(self._view, dtype=self.typecode).reshape(self.shape)
+
+
+def attach_shared(name):
+    """Attach to a `SharedArray` created by another process
+
+    Args:
+        name (str): `SharedArray.name`
+
+    Returns:
+        SharedArray: new handle to the same elements
+    """
+    return SharedArray(name=name)
+
+
+def from_numpy(value):
+    """Copy a one-dimensional numpy array into an array.array
+
+    array.array always owns its memory so one copy is required. Use
+    `to_numpy` in the other direction, which does not copy.
+
+    Args:
+        value (numpy.ndarray): contiguous array of a type array supports
+
+    Returns:
+        array.array: New, initialized array
+    """
+    return frombytes(value, typecode=value.dtype.char)
+
+
+def frombytes(value, typecode=DOUBLE_TYPECODE):
+    """Creates a new array from bytes (machine order) with one copy
+
+    Args:
+        value (object): bytes, memoryview, or any object with the buffer protocol
+        typecode (str): type of elements [DOUBLE_TYPECODE]
+
+    Returns:
+        array.array: New, initialized array
+    """
+    res = array.array(typecode)
+    # array only accepts byte formats
+    res.frombytes(memoryview(value).cast('B'))
+    return res
+
+
+def fromfile(filename, typecode=DOUBLE_TYPECODE, count=None):
+    """Read an array written by `tofile`
+
+    The elements are read directly into the array's buffer.
+
+    Args:
+        filename (str or py.path): file to read
+        typecode (str): type of elements [DOUBLE_TYPECODE]
+        count (int): number of elements to read [all]
+
+    Returns:
+        array.array: New, initialized array
+    """
+    res = array.array(typecode)
+    with io.open(str(filename), 'rb') as f:
+        if count is None:
+            count = os.fstat(f.fileno()).st_size // res.itemsize
+        res.fromfile(f, count)
+    return res
+
+
 def new_double(*args, **kwargs):
     """Creates a new double ("d") array
 
@@ -39,3 +476,306 @@ def new_float(*args, **kwargs):
         array.array: New, initialized array
     """
     return array.array(FLOAT_TYPECODE, *args, **kwargs)
+
+
+def new_int32(*args, **kwargs):
+    """Creates a new 32-bit signed int array
+
+    Args are the same as :func:`array.array` except for typecode,
+    which is passed by this module.
+
+    Returns:
+        array.array: New, initialized array
+    """
+    return array.array(INT32_TYPECODE, *args, **kwargs)
+
+
+def new_int64(*args, **kwargs):
+    """Creates a new 64-bit signed int array
+
+    Args are the same as :func:`array.array` except for typecode,
+    which is passed by this module.
+
+    Returns:
+        array.array: New, initialized array
+    """
+    return array.array(INT64_TYPECODE, *args, **kwargs)
+
+
+def new_shared(shape, typecode=DOUBLE_TYPECODE, initializer=None):
+    """Creates a `SharedArray` in POSIX shared memory
+
+    Elements are zero unless initializer is supplied. bytes and
+    bytearray initializers are copied as is. Buffers (e.g.
+    array.array) whose elements are not typecode are converted.
+
+    Args:
+        shape (int or tuple): number of elements or dimensions
+        typecode (str): type of elements [DOUBLE_TYPECODE]
+        initializer (object): bytes, buffer, or iterable of all elements
+
+    Returns:
+        SharedArray: new segment
+    """
+    if isinstance(shape, int):
+        shape = (shape,)
+    res = SharedArray(shape=shape, typecode=typecode)
+    if initializer is not None:
+        try:
+            res[:] = _typed_bytes(initializer, typecode).cast(typecode)
+        except Exception:
+            res.close()
+            raise
+    return res
+
+
+def new_uint8(*args, **kwargs):
+    """Creates a new unsigned byte ("B") array
+
+    Args are the same as :func:`array.array` except for typecode,
+    which is passed by this module.
+
+    Returns:
+        array.array: New, initialized array
+    """
+    return array.array(UINT8_TYPECODE, *args, **kwargs)
+
+
+def open_mapped(filename, mode='r', typecode=DOUBLE_TYPECODE, row_shape=()):
+    """Open or create a `MappedArray`
+
+    Use as a context manager to unmap and close::
+
+        with pkarray.open_mapped('history.pka', 'a', row_shape=(3,)) as h:
+            h.append((t, e, p))
+
+    Args:
+        filename (str or py.path): file to map
+        mode (str): "r" read-only, "a" append (create if missing), "w" create or replace
+        typecode (str): type of elements for new files [DOUBLE_TYPECODE]
+        row_shape (tuple): shape of each row for new files [()]
+
+    Returns:
+        MappedArray: mapped file
+    """
+    return MappedArray(filename, mode=mode, typecode=typecode, row_shape=row_shape)
+
+
+def to_numpy(value):
+    """View an array.array as a numpy array without copying
+
+    The view shares value's buffer so changes to elements are seen by
+    both. value cannot be resized (e.g. append) while the view exists.
+
+    Args:
+        value (array.array): array to view
+
+    Returns:
+        numpy.ndarray: one-dimensional view of value
+    """
+    import numpy
+
+    return numpy.frombuffer(value, dtype=value.typecode)
+
+
+def tofile(value, filename):
+    """Write array elements (machine order) to filename
+
+    Args:
+        value (array.array): array to write
+        filename (str or py.path): file to write
+    """
+    with io.open(str(filename), 'wb') as f:
+        value.tofile(f)
+
+
+def _mapped_lock(filename):
+    """Open and lock filename for writing, creating if missing
+
+    Args:
+        filename (str): `MappedArray` file
+
+    Returns:
+        int: file descriptor holding the lock
+    """
+    # Not at the top so the rest of the module works on Windows
+    import fcntl
+
+    while True:
+        res = os.open(filename, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(res, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                if os.stat(filename).st_ino == os.fstat(res).st_ino:
+                    return res
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        except (IOError, OSError) as e:
+            os.close(res)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                raise IOError(e.errno, 'another process is writing', filename)
+            raise
+        # Replaced (see `_mapped_replace`) or removed after it was opened
+        os.close(res)
+
+
+def _mapped_replace(filename, old):
+    """Rename a new, empty, locked file over filename
+
+    Args:
+        filename (str): `MappedArray` file
+        old (int): locked descriptor of filename, whose mode is copied
+
+    Returns:
+        int: file descriptor of the new file holding the lock
+    """
+    import fcntl
+
+    res, t = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)),
+        prefix='.' + os.path.basename(filename),
+    )
+    try:
+        os.fchmod(res, stat.S_IMODE(os.fstat(old).st_mode))
+        fcntl.flock(res, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(t, filename)
+    except Exception:
+        os.close(res)
+        os.remove(t)
+        raise
+    return res
+
+
+def _product(shape):
+    res = 1
+    for x in shape:
+        res *= x
+    return res
+
+
+def _shared_memory(shared_memory, name=None, create=False, size=0):
+    """Open segment without the multiprocessing resource tracker
+
+    The tracker unlinks segments when any process which opened them
+    exits, which breaks sharing with pool workers. `SharedArray`
+    unlinks by reference count instead.
+
+    Returns:
+        tuple: SharedMemory and whether it was unregistered from the tracker
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False), False
+    except TypeError:
+        # Before python 3.13
+        pass
+    from multiprocessing import resource_tracker
+
+    res = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(_shared_tracker_name(res), 'shared_memory')
+    return res, True
+
+
+def _shared_lock_path(shm):
+    """File to flock while changing references
+
+    Returns:
+        str: the segment itself on Linux, else a file in the temporary directory
+    """
+    if pkplatform.is_linux():
+        return os.path.join('/dev/shm', shm.name)
+    return os.path.join(tempfile.gettempdir(), shm.name + '.lock')
+
+
+def _shared_refs(shm, delta, create=False):
+    """Change references under lock
+
+    Args:
+        shm (SharedMemory): segment
+        delta (int): change in references
+        create (bool): whether the segment is new
+
+    Returns:
+        int: new count (0 if the segment was unlinked and delta is negative)
+    """
+    import fcntl
+
+    try:
+        f = os.open(
+            _shared_lock_path(shm),
+            os.O_RDWR | (os.O_CREAT if create else 0),
+            0o600,
+        )
+    except FileNotFoundError:
+        if delta > 0:
+            raise
+        # `SharedArray.unlink` was called
+        return 0
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        res = _SHARED_REFS.unpack_from(shm.buf, _SHARED_REFS_OFFSET)[0] + delta
+        _SHARED_REFS.pack_into(shm.buf, _SHARED_REFS_OFFSET, res)
+        return res
+    finally:
+        # releases the lock
+        os.close(f)
+
+
+def _shared_release(shm, view, untracked, referenced):
+    if referenced and _shared_refs(shm, -1) <= 0:
+        _shared_unlink(shm, untracked)
+    try:
+        if view is not None:
+            view.release()
+        shm.close()
+    except BufferError:
+        # Views exist so the memory is unmapped when they are released
+        pass
+
+
+def _shared_tracker_name(shm):
+    # SharedMemory registers the name with its leading slash
+    return '/' + shm.name
+
+
+def _shared_unlink(shm, untracked):
+    """Unlink segment, which may already be unlinked by `SharedArray.unlink`"""
+    if untracked:
+        from multiprocessing import resource_tracker
+
+        # unlink unregisters
+        resource_tracker.register(_shared_tracker_name(shm), 'shared_memory')
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        if untracked:
+            resource_tracker.unregister(_shared_tracker_name(shm), 'shared_memory')
+    if not pkplatform.is_linux():
+        try:
+            os.remove(_shared_lock_path(shm))
+        except FileNotFoundError:
+            pass
+
+
+def _typed_bytes(value, typecode):
+    """Bytes of value as elements of typecode
+
+    bytes and bytearray are used as is. Buffers with other element
+    types are converted, not reinterpreted.
+
+    Args:
+        value (object): bytes, buffer, or iterable of elements
+        typecode (str): type of elements
+
+    Returns:
+        memoryview: unsigned bytes
+    """
+    try:
+        m = memoryview(value)
+    except TypeError:
+        return memoryview(array.array(typecode, value)).cast('B')
+    if isinstance(value, (bytes, bytearray)) or m.format == typecode:
+        return m.cast('B')
+    if m.ndim > 1:
+        m = m.cast('B').cast(m.format)
+    return memoryview(array.array(typecode, m.tolist())).cast('B')
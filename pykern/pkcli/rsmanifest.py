@@ -68,7 +68,7 @@ def add_code(name, version, uri, source_d, virtual_env=None, pyenv=None):
         version=version,
     )
     values.codes[pyenv] = v
-    pkjson.dump_pretty(values, filename=fn)
+    pkjson.dump_pretty(values, filename=fn, atomic=True)
 
 
 def pkunit_setup():
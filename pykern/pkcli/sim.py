@@ -253,4 +253,4 @@ def _rsmanifest():
             #'environ': pkcollections.Dict(os.environ),
         },
     }
-    pkjson.dump_pretty(m, filename=rsmanifest.BASENAME)
+    pkjson.dump_pretty(m, filename=rsmanifest.BASENAME, atomic=True)
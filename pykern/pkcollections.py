@@ -13,6 +13,26 @@ from __future__ import absolute_import, division, print_function
 # Avoid pykern imports so avoid dependency issues for pkconfig
 import json
 
+#: Separator for `dotted_getter` and `dotted_setter` paths
+DOTTED_SEP = '.'
+
+#: How `deep_merge` combines lists by default
+LIST_MERGE_DEFAULT = 'replace'
+
+#: Valid values of ``list_merge`` in `deep_merge` (callables are also allowed)
+LIST_MERGE_MODES = ('append', 'prepend', 'replace')
+
+#: Implementations of `LIST_MERGE_MODES`; lists are only combined if both are lists
+_LIST_MERGE_OPS = dict(
+    append=lambda p, b, n: b + n if isinstance(b, list) and isinstance(n, list) else n,
+    prepend=lambda p, b, n: n + b if isinstance(b, list) and isinstance(n, list) else n,
+    replace=lambda p, b, n: n,
+)
+
+#: Marks no default passed to `dotted_getter`
+_NO_DEFAULT = object()
+
+
 class Dict(dict):
     """A subclass of dict that allows items to be read/written as attributes.
 
@@ -167,11 +187,129 @@ class OrderedMapping(object):
         setattr(self, key, value)
 
 
+def deep_merge(base, to_merge, list_merge=LIST_MERGE_DEFAULT):
+    """Merge nested dicts in to_merge into base
+
+    Walks the trees iteratively so arbitrarily deep or large trees
+    do not hit recursion limits. When both values at a key are
+    `dict` instances, they are merged. Otherwise, the value from
+    to_merge replaces the value in base, except for lists which are
+    combined according to ``list_merge``:
+
+        append
+            base list followed by to_merge list
+
+        prepend
+            to_merge list followed by base list
+
+        replace
+            to_merge list replaces base list
+
+    ``list_merge`` may also be a callable ``op(path, base_value, new_value)``,
+    which is called whenever either value is a list and returns the
+    merged value. ``path`` is a tuple of keys from the root.
+
+    Values in to_merge are not copied so base may share objects with
+    to_merge after the merge.
+
+    Args:
+        base (dict): modified in place
+        to_merge (dict): values to merge into base
+        list_merge (str or callable): how to combine lists [replace]
+
+    Returns:
+        dict: base
+    """
+    lm = list_merge
+    if not callable(lm):
+        assert lm in LIST_MERGE_MODES, \
+            '{}: invalid list_merge must be one of {}'.format(lm, LIST_MERGE_MODES)
+        lm = _LIST_MERGE_OPS[lm]
+    stack = [(base, to_merge, ())]
+    while stack:
+        b, n, path = stack.pop()
+        for k in n:
+            v = n[k]
+            if k in b:
+                bv = b[k]
+                if isinstance(bv, dict) and isinstance(v, dict):
+                    stack.append((bv, v, path + (k,)))
+                    continue
+                if isinstance(bv, list) or isinstance(v, list):
+                    v = lm(path + (k,), bv, v)
+            b[k] = v
+    return base
+
+
+def dotted_getter(path, default=_NO_DEFAULT):
+    """Compile path into a function which looks up nested values
+
+    The path is split once so the returned function can be applied
+    to many objects cheaply::
+
+        g = dotted_getter('a.b.c')
+        assert 1 == g(Dict(a=Dict(b=Dict(c=1))))
+
+    Args:
+        path (str or tuple): keys separated by `DOTTED_SEP` or sequence of keys
+        default (object): returned if any key is missing [raise KeyError]
+
+    Returns:
+        callable: called with the root object and returns the value
+    """
+    keys = _dotted_keys(path)
+
+    def _get(obj):
+        try:
+            for k in keys:
+                obj = obj[k]
+        except (KeyError, IndexError, TypeError):
+            if default is _NO_DEFAULT:
+                raise KeyError(path)
+            return default
+        return obj
+
+    return _get
+
+
+def dotted_setter(path, new_node=Dict):
+    """Compile path into a function which assigns nested values
+
+    Missing intermediate nodes are created by calling ``new_node``::
+
+        s = dotted_setter('a.b.c')
+        d = Dict()
+        s(d, 1)
+        assert 1 == d.a.b.c
+
+    Args:
+        path (str or tuple): keys separated by `DOTTED_SEP` or sequence of keys
+        new_node (callable): creates missing intermediate nodes [Dict]
+
+    Returns:
+        callable: called with the root object and the value to assign
+    """
+    keys = _dotted_keys(path)
+    parents = keys[:-1]
+    last = keys[-1]
+
+    def _set(obj, value):
+        for k in parents:
+            try:
+                obj = obj[k]
+            except KeyError:
+                obj[k] = new_node()
+                obj = obj[k]
+        obj[last] = value
+
+    return _set
+
+
 def json_load_any(obj, *args, **kwargs):
     """Read json file or str with ``object_pairs_hook=Dict``
 
     Args:
-        obj (object): str or object with "read"
+        obj (object): str, bytes, memoryview, or object with "read" (e.g. mmap)
         args (tuple): passed verbatim
         kwargs (dict): object_pairs_hook overriden
 
@@ -180,6 +318,9 @@ def json_load_any(obj, *args, **kwargs):
     """
     kwargs.setdefault('object_pairs_hook', object_pairs_hook)
     o = obj.read() if hasattr(obj, 'read') else obj
+    if isinstance(o, (bytearray, memoryview)):
+        # json only parses str and bytes
+        o = bytes(o)
     return json.loads(o, *args, **kwargs)
 
 
@@ -275,3 +416,18 @@ def unchecked_del(obj, key):
         del obj[key]
     except KeyError:
         pass
+
+
+def _dotted_keys(path):
+    """Split path into keys
+
+    Args:
+        path (str or tuple): keys separated by `DOTTED_SEP` or sequence of keys
+
+    Returns:
+        tuple: keys
+    """
+    res = tuple(path.split(DOTTED_SEP) if hasattr(path, 'split') else path)
+    assert res, \
+        '{}: path must contain at least one key'.format(path)
+    return res
@@ -386,20 +386,7 @@ def flatten_values(base, new):
     # exists already as a None. The other way is ok, because it
     # clears the value unless of course it's not a dict
     # then it would be a type collision
-    for k in sorted(new_values.keys()):
-        n = new_values[k]
-        if k in base:
-            b = base[k]
-            if isinstance(b, list) or isinstance(n, list):
-                if b is None or n is None:
-                    pass
-                elif isinstance(b, list) and isinstance(n, list):
-                    n.extend(b)
-                else:
-                    raise AssertionError(
-                        '{}: type mismatch between new value ({}) and base ({})'.format(
-                            k.msg, n, b))
-        base[k] = n
+    pkcollections.deep_merge(base, new_values, list_merge=_flatten_list_merge)
 
 
 @parse_none
@@ -603,6 +590,26 @@ def _flatten_keys(key_parts, values, res):
             res[k] = v
 
 
+def _flatten_list_merge(path, base, new):
+    """Prepend new list to base list for `flatten_values`
+
+    Args:
+        path (tuple): contains the `_Key` being merged
+        base (object): existing value
+        new (object): overriding value
+
+    Returns:
+        object: merged value
+    """
+    if base is None or new is None:
+        return new
+    if isinstance(base, list) and isinstance(new, list):
+        return new + base
+    raise AssertionError(
+        '{}: type mismatch between new value ({}) and base ({})'.format(
+            path[-1].msg, new, base))
+
+
 def _init_parsed_values(env):
     """Removes any values that match load_path from env
 
@@ -5,23 +5,244 @@ u"""Useful I/O operations
 :license: http://www.apache.org/licenses/LICENSE-2.0.html
 """
 from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
 from pykern import pkcompat
+from pykern import pkconfig
+from pykern import pkplatform
+import binascii
+import bz2
+import concurrent.futures
 import contextlib
 import copy
+import ctypes
+import ctypes.util
 import errno
 import glob
+import gzip
+import hashlib
 import io
 import locale
+import lzma
+import mmap
 import os
 import os.path
 import py
 import re
+import select
 import shutil
 import six
+import stat
+import struct
+import time
 
 #: used during unit testing see ``pykern.pkunit.save_chdir``
 pkunit_prefix = None
 
+#: Suffix of temporary files created by `open_atomic` and `AtomicBatch`
+ATOMIC_TMP_SUFFIX = '.pkio-tmp'
+
+#: Extensions of files which are (de)compressed transparently (zst requires zstandard)
+COMPRESSION_EXTENSIONS = ('bz2', 'gz', 'xz', 'zst')
+
+#: How `copy_tree` creates files: zero-copy transfer, hard links, or copy-on-write clones
+COPY_MODES = ('copy', 'hardlink', 'reflink')
+
+#: Default algorithm for `hash_file` and `hash_tree`
+HASH_ALGORITHM = 'sha256'
+
+#: Name of index file written by `hash_tree` in the directory being hashed
+HASH_INDEX_BASENAME = '.pkio-hash-index.json'
+
+#: Format version of `HASH_INDEX_BASENAME`
+_HASH_INDEX_VERSION = 1
+
+#: Files modified less than this many ns before `hash_tree` starts are not indexed
+_HASH_INDEX_RACY_NS = 2 * 10 ** 9
+
+#: Events reported by `iter_watch`
+WATCH_CREATE = 'create'
+WATCH_DELETE = 'delete'
+WATCH_MODIFY = 'modify'
+
+#: Reported by `iter_watch` when the kernel dropped events; rescan the tree
+WATCH_OVERFLOW = 'overflow'
+
+#: inotify(7) constants
+_IN_MODIFY = 0x2
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+#: What `iter_watch` asks inotify to report for each directory
+_IN_WATCH_MASK = _IN_MODIFY | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE \
+    | _IN_DELETE | _IN_DELETE_SELF | _IN_ONLYDIR
+
+#: struct inotify_event without name
+_IN_EVENT = struct.Struct('iIII')
+
+#: Size of blocks compressed concurrently by `write_text`
+_COMPRESS_BLOCK = 1 << 22
+
+#: ioctl(2) which clones a file on copy-on-write file systems (btrfs, xfs)
+_FICLONE = 0x40049409
+
+#: Errors which mean a zero-copy or clone call is not supported for these files
+_COPY_UNSUPPORTED = frozenset(
+    getattr(errno, e) for e in ('EINVAL', 'ENOSYS', 'ENOTSUP', 'ENOTTY', 'EOPNOTSUPP', 'EXDEV')
+    if hasattr(errno, e)
+)
+
+#: Number of files processed by each `copy_tree` and `remove_tree` task
+_TREE_BATCH = 64
+
+
+class AtomicBatch(object):
+    """Write many files atomically with one fsync per directory
+
+    Each file is written to a temporary file in the same directory
+    as its target. When the context exits without an exception,
+    all the files are renamed to their targets, and then each
+    directory is fsync'ed once. If there is an exception, the
+    temporary files are removed and the targets are untouched::
+
+        with pkio.AtomicBatch() as b:
+            for i, r in enumerate(results):
+                b.write_text('out/res{}.txt'.format(i), r)
+
+    Args:
+        fsync (bool): fsync files and directories before returning [True]
+    """
+    def __init__(self, fsync=True):
+        self.fsync = fsync
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            for t, _ in self._pending:
+                _unchecked_unlink(t)
+            self._pending = []
+            return False
+        self.commit()
+        return False
+
+    def commit(self):
+        """Rename pending files to their targets and fsync their directories"""
+        p = self._pending
+        self._pending = []
+        dirs = set()
+        for i, x in enumerate(p):
+            try:
+                os.replace(*x)
+            except Exception:
+                for t, _ in p[i:]:
+                    _unchecked_unlink(t)
+                raise
+            dirs.add(os.path.dirname(x[1]))
+        if self.fsync:
+            for d in sorted(dirs):
+                _fsync_dir(d)
+
+    @contextlib.contextmanager
+    def open(self, filename, mode='w'):
+        """Open a temporary file which will replace filename on `commit`
+
+        Args:
+            filename (str or py.path.Local): target file
+            mode (str): ``w`` (text in preferred encoding) or ``wb``
+
+        Yields:
+            file: open file object
+        """
+        fn = str(py_path(filename))
+        t, f = _open_tmp(fn, mode)
+        try:
+            with f:
+                yield f
+                _flush(f, self.fsync)
+        except Exception:
+            _unchecked_unlink(t)
+            raise
+        self._pending.append((t, fn))
+
+    def write_text(self, filename, contents):
+        """Write text with preferred encoding to be committed with the batch
+
+        Args:
+            filename (str or py.path.Local): target file
+            contents (str): New contents
+
+        Returns:
+            py.path.local: `filename` as :class:`py.path.Local`
+        """
+        with self.open(filename) as f:
+            f.write(pkcompat.locale_str(contents))
+        return py_path(filename)
+
+
+def copy_tree(src, dst, mode='copy', threads=None, progress=None, progress_interval=1.0):
+    """Copy directory src to dst in a thread pool
+
+    Directories are listed and files are copied concurrently. In
+    ``copy`` mode, file data is transferred in the kernel with
+    :func:`os.copy_file_range` or :func:`os.sendfile` when available.
+    ``hardlink`` links files in dst to the same inodes as src, which
+    must be on the same file system. ``reflink`` clones files on
+    copy-on-write file systems and falls back to ``copy`` when cloning
+    is not supported. Symbolic links are copied as links. File and
+    directory modes and times are copied. dst may already exist.
+
+    ``progress`` is called from the calling thread at most every
+    progress_interval seconds and once at the end with a
+    `pkcollections.Dict` containing ``files``, ``bytes``, ``seconds``,
+    and ``bytes_per_second``.
+
+    Args:
+        src (str or py.path.Local): directory to copy
+        dst (str or py.path.Local): destination directory
+        mode (str): one of `COPY_MODES` [copy]
+        threads (int): size of thread pool [cfg.scan_threads]
+        progress (callable): called with progress [None]
+        progress_interval (float): seconds between progress calls [1.0]
+
+    Returns:
+        py.path.Local: dst
+    """
+    assert mode in COPY_MODES, \
+        '{}: invalid mode must be one of {}'.format(mode, COPY_MODES)
+    s = str(py_path(src))
+    d = py_path(dst)
+    ds = str(d)
+    op = _COPY_OPS[mode]
+
+    def _dir(rel):
+        p = os.path.join(ds, rel)
+        if not os.path.isdir(p):
+            os.makedirs(p)
+
+    def _file(rel):
+        return op(os.path.join(s, rel), os.path.join(ds, rel))
+
+    p = concurrent.futures.ThreadPoolExecutor(max_workers=threads or cfg.scan_threads)
+    try:
+        dirs = _parallel_tree(s, _dir, _file, p, progress, progress_interval)
+    finally:
+        _shutdown_pool(p)
+    # After contents so directory times are not changed by the copy
+    for r in reversed(dirs):
+        shutil.copystat(os.path.join(s, r), os.path.join(ds, r))
+    return d
+
 
 def exception_is_not_found(exc):
     """True if exception is IOError and ENOENT
@@ -65,6 +286,225 @@ def has_file_extension(filename, to_check):
     return e in to_check
 
 
+def iter_tree(dirname, file_re=None, prune_re=None, relative=False):
+    """Yield files (only) as str paths, top down, sorted, without building a list
+
+    Uses `os.scandir` so only one `os.DirEntry` list per directory is
+    held in memory. Entries are ordered so that the sequence of paths
+    is identical to sorting all paths as strings, which is the same
+    order returned by `walk_tree`.
+
+    Regular expressions are matched against the path relative to
+    `dirname`, e.g. ``d1/f1``. Symbolic links to directories are
+    not followed (and not returned), and unreadable directories are
+    skipped, which is the same as :func:`os.walk`.
+
+    Use `scan_tree` to read directories in parallel.
+
+    Args:
+        dirname (str): directory to walk
+        file_re (re or str): Optionally, only return files which match file_re
+        prune_re (re or str): Optionally, do not descend into directories which match prune_re
+        relative (bool): yield paths relative to dirname [False]
+
+    Yields:
+        str: absolute paths in sorted order
+    """
+    return _walk_tree(
+        dirname,
+        file_re,
+        prune_re,
+        relative,
+        False,
+        lambda d: lambda: _sorted_scandir(d, False),
+    )
+
+
+def hash_file(filename, algorithm=HASH_ALGORITHM, chunk_size=None):
+    """Compute hex digest of filename's contents reading in chunks
+
+    Args:
+        filename (str or py.path.Local): File to read
+        algorithm (str): name passed to :func:`hashlib.new` [sha256]
+        chunk_size (int): bytes per read [cfg.chunk_size]
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.new(algorithm)
+    for b in iter_chunks(filename, chunk_size=chunk_size, decompress=False):
+        h.update(b)
+    return h.hexdigest()
+
+
+def hash_tree(dirname, file_re=None, algorithm=HASH_ALGORITHM, threads=None, index=True):
+    """Compute digests of all files in dirname in parallel
+
+    Files are found with `scan_tree` and hashed with `hash_file` in a
+    thread pool. If index is True, the digests are saved in
+    `HASH_INDEX_BASENAME` in dirname along with each file's size,
+    mtime, and inode. On the next call, files whose stat values have
+    not changed are not read so rehashing an unchanged tree only costs
+    stat calls. Files modified just before the call are not indexed,
+    because a subsequent write in the same mtime tick would go unnoticed.
+    With file_re, the entries of other files are kept in the index.
+
+    Args:
+        dirname (str or py.path.Local): directory to hash
+        file_re (re or str): Optionally, only hash files which match file_re
+        algorithm (str): name passed to :func:`hashlib.new` [sha256]
+        threads (int): size of thread pools [cfg.scan_threads]
+        index (bool): read and write `HASH_INDEX_BASENAME` [True]
+
+    Returns:
+        pkcollections.Dict: relative path to hex digest in sorted order
+    """
+    d = py_path(dirname)
+    ifn = d.join(HASH_INDEX_BASENAME)
+    prev = _hash_index_read(ifn, algorithm) if index else {}
+    racy = _stat_mtime_ns(time.time()) - _HASH_INDEX_RACY_NS
+    res = pkcollections.Dict()
+    fr = _compile_re(file_re)
+    new = {}
+    p = concurrent.futures.ThreadPoolExecutor(max_workers=threads or cfg.scan_threads)
+    try:
+        for r, st in scan_tree(d, file_re=fr, relative=True, want_stat=True, threads=threads):
+            if r == HASH_INDEX_BASENAME or st is None:
+                continue
+            k = [st.st_size, _stat_mtime_ns(st), st.st_ino]
+            x = prev.get(r)
+            if x and x[:3] == k:
+                res[r] = x[3]
+            else:
+                res[r] = p.submit(hash_file, d.join(r), algorithm)
+            if k[1] < racy:
+                new[r] = k
+        for r, v in res.items():
+            if isinstance(v, concurrent.futures.Future):
+                res[r] = v.result()
+    finally:
+        _shutdown_pool(p)
+    if index:
+        for r, k in new.items():
+            k.append(res[r])
+        if fr:
+            # keep the files which were not scanned
+            new.update((r, v) for r, v in prev.items() if not fr.search(r))
+        if new != prev:
+            _hash_index_write(ifn, algorithm, new)
+    return res
+
+
+def iter_chunks(filename, chunk_size=None, decompress=True):
+    """Yield binary contents of filename in chunks
+
+    Args:
+        filename (str or py.path.Local): File to read
+        chunk_size (int): bytes per read [cfg.chunk_size]
+        decompress (bool): decompress `COMPRESSION_EXTENSIONS` [True]
+
+    Yields:
+        bytes: next chunk (last may be shorter)
+    """
+    n = chunk_size or cfg.chunk_size
+    fn = str(py_path(filename))
+    if decompress and _compression(fn):
+        f = open_compressed(fn)
+    else:
+        f = io.open(fn, 'rb', buffering=0)
+    with f:
+        while True:
+            b = f.read(n)
+            if not b:
+                return
+            yield b
+
+
+def iter_lines(filename, chunk_size=None):
+    """Yield lines of filename decoded incrementally with preferred encoding
+
+    Only one buffer of chunk_size bytes is held in memory so very large
+    files can be processed line by line. `COMPRESSION_EXTENSIONS` are
+    decompressed.
+
+    Args:
+        filename (str or py.path.Local): File to read
+        chunk_size (int): size of read buffer in bytes [cfg.chunk_size]
+
+    Yields:
+        str: line including newline (last may not have a newline)
+    """
+    with open_text(filename, chunk_size=chunk_size or cfg.chunk_size) as f:
+        for l in f:
+            yield l
+
+
+def iter_watch(dirname, debounce=0.1, max_delay=None, timeout=None, poll=1.0, force_poll=False):
+    """Yield batches of file create, modify, and delete events in dirname
+
+    On Linux, inotify(7) (via ctypes) reports changes as they happen
+    so short-lived files are seen and idle trees cost nothing. Elsewhere,
+    or if force_poll, the tree is scanned every poll seconds and compared
+    with the previous scan.
+
+    A batch is returned once no events have arrived for debounce
+    seconds (or max_delay seconds after the first event). Events are
+    coalesced per path: repeated events are dropped and a modify after
+    a create is reported as the create. A create followed by a delete
+    reports both. `WATCH_OVERFLOW` means events were lost.
+
+    Events are on files except for directory moves with inotify: a
+    directory moved out of the tree is a single delete of the
+    directory, and one moved in is a create of the directory followed
+    by a create for each file in it. Polling reports each file.
+
+    Watching starts with the first ``next`` so events which happen
+    before that are not reported.
+
+    Args:
+        dirname (str or py.path.Local): directory to watch
+        debounce (float): seconds of quiet which end a batch [0.1]
+        max_delay (float): longest a batch is delayed [10 * debounce]
+        timeout (float): yield an empty batch after this many idle seconds [wait forever]
+        poll (float): seconds between scans when polling [1.0]
+        force_poll (bool): do not use inotify [False]
+
+    Yields:
+        list: (event, relative path) tuples in order of occurrence
+    """
+    root = str(py_path(dirname).realpath())
+    w = None
+    if not force_poll and pkplatform.is_linux():
+        try:
+            w = _Inotify(root)
+        except (AttributeError, OSError):
+            # libc without inotify
+            pass
+    if not w:
+        for b in _iter_watch_poll(root, poll, timeout):
+            yield b
+        return
+    md = debounce * 10 if max_delay is None else max_delay
+    try:
+        w.add_tree('', None)
+        while True:
+            if not w.wait(timeout):
+                yield []
+                continue
+            e = []
+            w.read(e)
+            t = time.time() + md
+            while w.wait(max(0, min(debounce, t - time.time()))):
+                w.read(e)
+                if time.time() >= t:
+                    break
+            e = _watch_coalesce(e)
+            if e:
+                yield e
+    finally:
+        w.close()
+
+
 def mkdir_parent(path):
     """Create the directories and their parents (if necessary)
 
@@ -89,6 +529,107 @@ def mkdir_parent_only(path):
     return mkdir_parent(py_path(path).dirname)
 
 
+@contextlib.contextmanager
+def open_atomic(filename, mode='w', fsync=True):
+    """Open a temporary file, which replaces filename when closed
+
+    The temporary file is in the same directory as filename so the
+    rename is atomic. Readers see either the old or new contents,
+    never a partial file. If an exception is raised, the temporary
+    file is removed and filename is untouched.
+
+    Use `AtomicBatch` to write many files.
+
+    Args:
+        filename (str or py.path.Local): target file
+        mode (str): ``w`` (text in preferred encoding) or ``wb``
+        fsync (bool): fsync the file and its directory for durability [True]
+
+    Yields:
+        file: open file object
+    """
+    with AtomicBatch(fsync=fsync) as b:
+        with b.open(filename, mode=mode) as f:
+            yield f
+
+
+@contextlib.contextmanager
+def open_mmap(filename):
+    """Memory map filename read-only
+
+    The contents are paged in by the operating system as they are
+    accessed so large files can be sliced, searched, or parsed without
+    reading them into memory. Slices of the map are bytes, and
+    ``memoryview(m)`` gives zero-copy access (release the view before
+    the context exits). The map has a ``read`` method so it can be
+    passed to loaders which accept streams, e.g. `pkyaml.load_file`.
+
+    Args:
+        filename (str or py.path.Local): File to map
+
+    Yields:
+        mmap.mmap: read-only map (bytes with ``read`` if the file is empty, which cannot be mapped)
+    """
+    with io.open(str(py_path(filename)), 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield _EmptyMap()
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield m
+        finally:
+            m.close()
+
+
+def open_compressed(filename, mode='rb', level=None, threads=None):
+    """Open binary file, (de)compressing if it has a `COMPRESSION_EXTENSIONS`
+
+    Args:
+        filename (str or py.path.Local): File to open
+        mode (str): ``rb``, ``wb``, or ``ab`` [rb]
+        level (int): compression level [format's default]
+        threads (int): compression threads (zst only) [1]
+
+    Returns:
+        file: binary file object
+    """
+    fn = str(py_path(filename))
+    c = _compression(fn)
+    if not c:
+        return io.open(fn, mode)
+    if c == 'gz':
+        return gzip.open(fn, mode, **({} if level is None else dict(compresslevel=level)))
+    if c == 'bz2':
+        return bz2.BZ2File(fn, mode, compresslevel=9 if level is None else level)
+    if c == 'xz':
+        return lzma.LZMAFile(fn, mode, preset=None if 'r' in mode else level)
+    z = _zstandard()
+    return z.open(
+        fn,
+        mode,
+        cctx=None if 'r' in mode else _zstd_compressor(z, level, threads),
+    )
+
+
+def open_text(filename, chunk_size=None):
+    """Open filename for reading text with preferred encoding
+
+    `COMPRESSION_EXTENSIONS` are decompressed as they are read.
+
+    Args:
+        filename (str or py.path.Local): File to open
+        chunk_size (int): size of read buffer in bytes (uncompressed only) [io.DEFAULT_BUFFER_SIZE]
+
+    Returns:
+        file: text file object
+    """
+    fn = str(py_path(filename))
+    e = locale.getpreferredencoding()
+    if _compression(fn):
+        return io.TextIOWrapper(open_compressed(fn), encoding=e)
+    return io.open(fn, encoding=e, buffering=chunk_size or -1)
+
+
 def py_path(path=None):
     """Creates a py.path.Local object
 
@@ -123,9 +664,61 @@ def read_text(filename):
     Returns:
         str: contest of `filename`
     """
-    fn = py_path(filename)
-    with io.open(str(fn), encoding=locale.getpreferredencoding()) as f:
-        return f.read();
+    with open_text(filename) as f:
+        return f.read()
+
+
+def remove_tree(dirname, threads=None, progress=None, progress_interval=1.0, ignore_errors=False):
+    """Remove directory and its contents in a thread pool
+
+    Files are unlinked concurrently across directories, and then
+    directories are removed deepest first. Symbolic links are removed,
+    not followed. Will not remove '/' or '.'
+
+    ``progress`` is called as in `copy_tree` (``bytes`` is always 0).
+
+    Args:
+        dirname (str or py.path.Local): directory to remove
+        threads (int): size of thread pool [cfg.scan_threads]
+        progress (callable): called with progress [None]
+        progress_interval (float): seconds between progress calls [1.0]
+        ignore_errors (bool): ignore OSError [False]
+    """
+    d = py_path(dirname)
+    _assert_removable(d)
+    d = str(d)
+
+    def _unchecked(op):
+        def _f(path):
+            try:
+                op(path)
+            except OSError:
+                if not ignore_errors:
+                    raise
+            return 0
+        return _f
+
+    remove = _unchecked(os.remove)
+    rmdir = _unchecked(os.rmdir)
+    p = concurrent.futures.ThreadPoolExecutor(max_workers=threads or cfg.scan_threads)
+    try:
+        dirs = _parallel_tree(
+            d,
+            None,
+            lambda r: remove(os.path.join(d, r)),
+            p,
+            progress,
+            progress_interval,
+            ignore_errors=ignore_errors,
+        )
+        x = {}
+        for r in dirs:
+            x.setdefault(r.count(os.sep) + bool(r), []).append(os.path.join(d, r))
+        for k in sorted(x, reverse=True):
+            # list() so exceptions are raised
+            list(p.map(rmdir, x[k]))
+    finally:
+        _shutdown_pool(p)
 
 
 @contextlib.contextmanager
@@ -161,16 +754,70 @@ def save_chdir(dirname, mkdir=False, is_pkunit_prefix=False):
             pkunit_prefix = prev_ppp
 
 
-def sorted_glob(path):
+def scan_tree(dirname, file_re=None, prune_re=None, relative=False, want_stat=False, threads=None):
+    """Like `iter_tree`, but reads directories and stats files in a thread pool
+
+    On network and parallel file systems, the latency of reading
+    directories and stat'ing files dominates. When a directory is
+    entered, all of its subdirectories are submitted to the pool so
+    they are read concurrently while the paths are yielded in the
+    same deterministic order as `iter_tree`. Only the directories
+    along the current path and their children are held in memory.
+
+    Args:
+        dirname (str): directory to walk
+        file_re (re or str): Optionally, only return files which match file_re
+        prune_re (re or str): Optionally, do not descend into directories which match prune_re
+        relative (bool): yield paths relative to dirname [False]
+        want_stat (bool): yield ``(path, os.stat_result)``; stat is None if it fails [False]
+        threads (int): size of thread pool [cfg.scan_threads]
+
+    Yields:
+        str: absolute paths (or tuples if want_stat) in sorted order
+    """
+    p = concurrent.futures.ThreadPoolExecutor(max_workers=threads or cfg.scan_threads)
+    try:
+        for x in _walk_tree(
+            dirname,
+            file_re,
+            prune_re,
+            relative,
+            want_stat,
+            lambda d: p.submit(_sorted_scandir, d, want_stat).result,
+        ):
+            yield x
+    finally:
+        _shutdown_pool(p)
+
+
+def sorted_glob(path, threads=None):
     """sorted list of py.path.Local objects, non-recursive
 
+    If threads is set and the directory part of `path` contains a
+    wildcard, the matching directories are globbed concurrently.
+
     Args:
         path (py.path.Local or str): pattern
+        threads (int): size of thread pool [serial]
 
     Returns:
         list: py.path.Local objects
     """
-    return sorted(py_path(f) for f in glob.glob(str(path)))
+    path = str(path)
+    d, b = os.path.split(path)
+    if not threads or not glob.has_magic(d):
+        return sorted(py_path(f) for f in glob.glob(path))
+    p = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    try:
+        res = []
+        for x in p.map(
+            lambda x: glob.glob(os.path.join(glob.escape(x), b)),
+            glob.glob(d),
+        ):
+            res.extend(x)
+    finally:
+        _shutdown_pool(p)
+    return sorted(py_path(f) for f in res)
 
 
 def unchecked_remove(*paths):
@@ -181,61 +828,815 @@ def unchecked_remove(*paths):
     Args:
         paths (str): paths to remove
     """
-    cwd = py_path()
     for a in paths:
-        p = py_path(a)
-        assert len(p.parts()) > 1, \
-            '{}: will not remove root directory'.format(p)
-        assert cwd != p, \
-            '{}: will not remove current directory'.format(p)
+        _assert_removable(py_path(a))
         try:
             os.remove(str(a))
         except OSError:
-            try:
-                shutil.rmtree(str(a), ignore_errors=True)
-            except OSError:
-                pass
+            remove_tree(str(a), ignore_errors=True)
 
 
-def walk_tree(dirname, file_re=None):
+def walk_tree(dirname, file_re=None, threads=None):
     """Return list files (only) as py.path's, top down, sorted
 
     If you want to go bottom up, just reverse the list.
 
+    Use `iter_tree` if you don't need a list or want to prune directories.
+
     Args:
         dirname (str): directory to walk
-        match_re (re or str): Optionally, only return files which match file_re
+        file_re (re or str): Optionally, only return files which match file_re
+        threads (int): read directories with `scan_tree` in this many threads [serial]
 
-    Yields:
-        py.path.local: paths in sorted order
+    Returns:
+        list: py.path.local paths in sorted order
     """
-    fr = file_re
-    if fr and not hasattr(fr, 'search'):
-        fr = re.compile(fr)
-    dirname = py_path(dirname).realpath()
-    dn = str(dirname)
-    res = []
-    for r, d, files in os.walk(dn, topdown=True, onerror=None, followlinks=False):
-        for f in files:
-            p = py_path(r).join(f)
-            if fr and not fr.search(dirname.bestrelpath(p)):
-                continue
-            res.append(p)
+    if threads:
+        i = scan_tree(dirname, file_re=file_re, threads=threads)
+    else:
+        i = iter_tree(dirname, file_re=file_re)
     # Not an iterator, but works as one. Don't assume always will return list
-    return sorted(res)
+    return [py.path.local(p) for p in i]
+
 
+def watch_tree(dirname, callback, **kwargs):
+    """Call callback with batches of events from `iter_watch`
+
+    Args:
+        dirname (str or py.path.Local): directory to watch
+        callback (callable): called with each batch; return False to stop watching
+        kwargs (dict): passed to `iter_watch`
+    """
+    for b in iter_watch(dirname, **kwargs):
+        if callback(b) is False:
+            return
 
-def write_text(filename, contents):
+
+def write_text(filename, contents, atomic=False, fsync=True, level=None, threads=None):
     """Open file, write text with preferred encoding, and close.
 
+    `COMPRESSION_EXTENSIONS` are compressed. With threads, gz, bz2, and
+    xz contents are compressed in blocks concurrently and written as
+    a multi-stream file, which all readers of those formats accept.
+
     Args:
         filename (str or py.path.Local): File to open
         contents (str): New contents
+        atomic (bool): write with `open_atomic` [False]
+        fsync (bool): if atomic, fsync file and directory [True]
+        level (int): compression level [format's default]
+        threads (int): compression threads [1]
 
     Returns:
         py.path.local: `filename` as :class:`py.path.Local`
     """
     fn = py_path(filename)
+    c = _compression(str(fn))
+    if c:
+        b = _compress(
+            c,
+            pkcompat.locale_str(contents).encode(locale.getpreferredencoding()),
+            level,
+            threads,
+        )
+        if atomic:
+            with open_atomic(fn, mode='wb', fsync=fsync) as f:
+                f.write(b)
+        else:
+            with io.open(str(fn), 'wb') as f:
+                f.write(b)
+        return fn
+    if atomic:
+        with open_atomic(fn, fsync=fsync) as f:
+            f.write(pkcompat.locale_str(contents))
+        return fn
     with io.open(str(fn), 'w', encoding=locale.getpreferredencoding()) as f:
         f.write(pkcompat.locale_str(contents))
     return fn
+
+
+class _EmptyMap(bytes):
+    """Stands in for `mmap.mmap` of an empty file in `open_mmap`"""
+
+    def close(self):
+        pass
+
+    def read(self, size=-1):
+        return b''
+
+
+class _Progress(object):
+    """Accumulates and reports progress for `copy_tree` and `remove_tree`
+
+    Args:
+        callback (callable): called with `pkcollections.Dict` or None
+        interval (float): minimum seconds between calls
+    """
+    def __init__(self, callback, interval):
+        self._callback = callback
+        self._interval = interval
+        self._start = time.time()
+        self._next = self._start + interval
+        self.bytes = 0
+        self.files = 0
+
+    def add(self, files, nbytes):
+        self.files += files
+        self.bytes += nbytes
+
+    def report(self, force=False):
+        if not self._callback:
+            return
+        t = time.time()
+        if not force and t < self._next:
+            return
+        self._next = t + self._interval
+        s = t - self._start
+        self._callback(pkcollections.Dict(
+            bytes=self.bytes,
+            bytes_per_second=self.bytes / s if s > 0 else 0.0,
+            files=self.files,
+            seconds=s,
+        ))
+
+
+class _Inotify(object):
+    """Recursive directory watch using inotify(7)
+
+    Args:
+        root (str): real path of directory to watch
+    """
+    def __init__(self, root):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._root = root
+        # watch descriptor to relative directory prefix ('' or ends with os.sep)
+        self._dirs = {}
+
+    def add_tree(self, rel, events):
+        """Watch rel and its subdirectories
+
+        Args:
+            rel (str): relative directory
+            events (list): if not None, append `WATCH_CREATE` for existing files
+        """
+        stack = [rel]
+        while stack:
+            r = stack.pop()
+            p = os.path.join(self._root, r)
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(p), _IN_WATCH_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e in (errno.ENOENT, errno.ENOTDIR):
+                    # removed before it could be watched
+                    continue
+                raise OSError(e, 'inotify_add_watch failed', p)
+            r = os.path.join(r, '') if r else ''
+            self._dirs[wd] = r
+            # List after the watch is added so no file is missed
+            for x, n, d, _ in _sorted_scandir(p, False):
+                if d:
+                    stack.append(r + n)
+                elif events is not None:
+                    events.append((WATCH_CREATE, r + n))
+
+    def close(self):
+        os.close(self.fd)
+
+    def read(self, events):
+        """Read all available events
+
+        Args:
+            events (list): appends (event, relative path)
+        """
+        while True:
+            try:
+                b = os.read(self.fd, 1 << 16)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            i = 0
+            while i < len(b):
+                wd, m, _, n = _IN_EVENT.unpack_from(b, i)
+                i += _IN_EVENT.size
+                self._event(wd, m, os.fsdecode(b[i:i + n].rstrip(b'\0')), events)
+                i += n
+
+    def wait(self, timeout):
+        """Wait for events
+
+        Args:
+            timeout (float): seconds or None for forever
+
+        Returns:
+            bool: True if events are available
+        """
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def _event(self, wd, mask, name, events):
+        if mask & _IN_Q_OVERFLOW:
+            events.append((WATCH_OVERFLOW, ''))
+            return
+        d = self._dirs.get(wd)
+        if d is None:
+            return
+        if mask & _IN_IGNORED:
+            del self._dirs[wd]
+            return
+        if mask & _IN_DELETE_SELF:
+            return
+        r = d + name
+        if mask & _IN_ISDIR:
+            if mask & (_IN_CREATE | _IN_MOVED_TO):
+                if mask & _IN_MOVED_TO:
+                    events.append((WATCH_CREATE, r))
+                self.add_tree(r, events)
+            elif mask & _IN_MOVED_FROM:
+                events.append((WATCH_DELETE, r))
+                self._remove_tree(r)
+            return
+        if mask & (_IN_CREATE | _IN_MOVED_TO):
+            events.append((WATCH_CREATE, r))
+        elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+            events.append((WATCH_DELETE, r))
+        elif mask & _IN_MODIFY:
+            events.append((WATCH_MODIFY, r))
+
+    def _remove_tree(self, rel):
+        """Stop watching rel (moved out of its parent) and its subdirectories"""
+        p = os.path.join(rel, '')
+        for wd, r in list(self._dirs.items()):
+            if r.startswith(p):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self._dirs[wd]
+
+
+def _assert_removable(path):
+    """Will not remove '/' or '.'
+
+    Args:
+        path (py.path.Local): to check
+    """
+    assert len(path.parts()) > 1, \
+        '{}: will not remove root directory'.format(path)
+    assert py_path() != path, \
+        '{}: will not remove current directory'.format(path)
+
+
+def _compile_re(value):
+    """Compile value unless None or already compiled
+
+    Args:
+        value (re or str): pattern
+
+    Returns:
+        re: compiled pattern or None
+    """
+    if value and not hasattr(value, 'search'):
+        return re.compile(value)
+    return value
+
+
+def _compress(compression, data, level, threads):
+    """Compress data in memory
+
+    Args:
+        compression (str): one of `COMPRESSION_EXTENSIONS`
+        data (bytes): to compress
+        level (int): compression level
+        threads (int): compress blocks concurrently if > 1
+
+    Returns:
+        bytes: compressed data
+    """
+    if compression == 'zst':
+        z = _zstandard()
+        return _zstd_compressor(z, level, threads).compress(data)
+    if compression == 'gz':
+        op = lambda b: gzip.compress(b, compresslevel=9 if level is None else level)
+    elif compression == 'bz2':
+        op = lambda b: bz2.compress(b, 9 if level is None else level)
+    else:
+        op = lambda b: lzma.compress(b, preset=level)
+    if not threads or threads < 2 or len(data) <= _COMPRESS_BLOCK:
+        return op(data)
+    m = memoryview(data)
+    p = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    try:
+        return b''.join(
+            p.map(op, [m[i:i + _COMPRESS_BLOCK] for i in range(0, len(m), _COMPRESS_BLOCK)]),
+        )
+    finally:
+        _shutdown_pool(p)
+
+
+def _compression(filename):
+    """Compression format of filename
+
+    Args:
+        filename (str): file name
+
+    Returns:
+        str: one of `COMPRESSION_EXTENSIONS` or None
+    """
+    e = os.path.splitext(filename)[1][1:].lower()
+    return e if e in COMPRESSION_EXTENSIONS else None
+
+
+def _copy_fd(src, dst):
+    """Copy open file src to dst in the kernel if possible
+
+    Args:
+        src (file): opened for reading at offset 0
+        dst (file): opened for writing and empty
+
+    Returns:
+        int: bytes copied
+    """
+    n = os.fstat(src.fileno()).st_size
+    for op in ('copy_file_range', 'sendfile'):
+        f = getattr(os, op, None)
+        if not f:
+            continue
+        o = 0
+        try:
+            while o < n:
+                if op == 'sendfile':
+                    c = f(dst.fileno(), src.fileno(), o, n - o)
+                else:
+                    c = f(src.fileno(), dst.fileno(), n - o, o, o)
+                if c == 0:
+                    break
+                o += c
+            return o
+        except OSError as e:
+            if e.errno not in _COPY_UNSUPPORTED:
+                raise
+            dst.truncate(0)
+    src.seek(0)
+    dst.seek(0)
+    shutil.copyfileobj(src, dst, cfg.chunk_size)
+    return n
+
+
+def _copy_file(src, dst, clone=False):
+    """Copy src file or symlink to dst with zero-copy transfer or clone
+
+    Args:
+        src (str): file to copy
+        dst (str): replaced if exists
+        clone (bool): try FICLONE first
+
+    Returns:
+        int: bytes copied
+    """
+    # dst may be a hardlink or symlink, which must not be written through
+    _unchecked_unlink(dst)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return 0
+    with io.open(src, 'rb') as s, io.open(dst, 'wb') as d:
+        n = None
+        if clone:
+            try:
+                # Not at the top, because it is not available on Windows
+                import fcntl
+
+                fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+                n = os.fstat(s.fileno()).st_size
+            except ImportError:
+                pass
+            except (IOError, OSError) as e:
+                if e.errno not in _COPY_UNSUPPORTED:
+                    raise
+        if n is None:
+            n = _copy_fd(s, d)
+    shutil.copystat(src, dst)
+    return n
+
+
+def _flush(f, fsync):
+    """Flush file and optionally fsync
+
+    Args:
+        f (file): open file
+        fsync (bool): call os.fsync
+    """
+    f.flush()
+    if fsync:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(dirname):
+    """Make renames in dirname durable
+
+    Args:
+        dirname (str): directory to fsync
+    """
+    fd = os.open(dirname or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _hardlink_file(src, dst):
+    """Link dst to src replacing dst
+
+    Args:
+        src (str): file to link to
+        dst (str): new link
+
+    Returns:
+        int: size of src
+    """
+    _unchecked_unlink(dst)
+    os.link(src, dst)
+    return os.lstat(src).st_size
+
+
+def _hash_index_read(filename, algorithm):
+    """Read `HASH_INDEX_BASENAME` if it exists and is compatible
+
+    Args:
+        filename (py.path.Local): index file
+        algorithm (str): must match algorithm in index
+
+    Returns:
+        dict: relative path to [size, mtime_ns, inode, digest]
+    """
+    from pykern import pkjson
+
+    try:
+        with io.open(str(filename), 'rb') as f:
+            i = pkjson.load_any(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if i.get('version') != _HASH_INDEX_VERSION or i.get('algorithm') != algorithm:
+        return {}
+    return i.get('files') or {}
+
+
+def _hash_index_write(filename, algorithm, files):
+    """Write `HASH_INDEX_BASENAME` atomically
+
+    Args:
+        filename (py.path.Local): index file
+        algorithm (str): used for digests
+        files (dict): relative path to [size, mtime_ns, inode, digest]
+    """
+    from pykern import pkjson
+
+    pkjson.dump_pretty(
+        dict(version=_HASH_INDEX_VERSION, algorithm=algorithm, files=files),
+        filename=filename,
+        pretty=False,
+        atomic=True,
+        fsync=False,
+    )
+
+
+def _iter_watch_poll(root, poll, timeout):
+    """Implements `iter_watch` by comparing scans of root
+
+    Args:
+        root (str): directory to watch
+        poll (float): seconds between scans
+        timeout (float): yield an empty batch after this many idle seconds
+
+    Yields:
+        list: (event, relative path) tuples
+    """
+    prev = _watch_snapshot(root)
+    idle = 0
+    while True:
+        time.sleep(poll)
+        cur = _watch_snapshot(root)
+        e = []
+        for r in sorted(set(prev).union(cur)):
+            if r not in prev:
+                e.append((WATCH_CREATE, r))
+            elif r not in cur:
+                e.append((WATCH_DELETE, r))
+            elif prev[r] != cur[r]:
+                e.append((WATCH_MODIFY, r))
+        prev = cur
+        idle += poll
+        if e or timeout is not None and idle >= timeout:
+            idle = 0
+            yield e
+
+
+def _open_tmp(filename, mode):
+    """Create a unique temporary file next to filename
+
+    If filename exists, its mode and owner (if permitted) are copied
+    so the rename does not change them. Otherwise, the file is created
+    with mode 0666 so the process umask applies as it would to filename.
+
+    Args:
+        filename (str): target file
+        mode (str): ``w`` or ``wb``
+
+    Returns:
+        tuple: (temporary file name, open file)
+    """
+    assert mode in ('w', 'wb'), \
+        '{}: invalid mode must be w or wb'.format(mode)
+    while True:
+        t = '{}.{}{}'.format(filename, binascii.hexlify(os.urandom(4)).decode('ascii'), ATOMIC_TMP_SUFFIX)
+        try:
+            fd = os.open(t, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    try:
+        try:
+            s = os.stat(filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            os.fchmod(fd, stat.S_IMODE(s.st_mode))
+            x = os.fstat(fd)
+            if (s.st_uid, s.st_gid) != (x.st_uid, x.st_gid):
+                try:
+                    os.fchown(fd, s.st_uid, s.st_gid)
+                except OSError as e:
+                    # Only root can give away files
+                    if e.errno != errno.EPERM:
+                        raise
+        if mode == 'wb':
+            return t, io.open(fd, 'wb')
+        return t, io.open(fd, 'w', encoding=locale.getpreferredencoding())
+    except Exception:
+        os.close(fd)
+        _unchecked_unlink(t)
+        raise
+
+
+def _parallel_tree(root, dir_op, file_op, pool, progress, progress_interval, ignore_errors=False):
+    """Traverse root in pool calling dir_op and file_op
+
+    Directories are listed in the pool and their files are processed
+    in batches of `_TREE_BATCH`. Subdirectories are submitted after
+    dir_op is called on their parent. Symbolic links are treated as
+    files. Exceptions are raised in the calling thread.
+
+    Args:
+        root (str): directory to traverse
+        dir_op (callable): called with relative directory before it is listed (may be None)
+        file_op (callable): called with relative file, returns bytes processed
+        pool (concurrent.futures.Executor): where to run operations
+        progress (callable): see `copy_tree`
+        progress_interval (float): see `copy_tree`
+        ignore_errors (bool): directories which cannot be listed are treated as empty [False]
+
+    Returns:
+        list: relative directories (root is '') parents before children
+    """
+    def _dir(rel):
+        if dir_op:
+            dir_op(rel)
+        d = []
+        f = []
+        try:
+            for e in os.scandir(os.path.join(root, rel)):
+                (d if e.is_dir(follow_symlinks=False) else f).append(os.path.join(rel, e.name))
+        except OSError:
+            if not ignore_errors:
+                raise
+        return rel, d, f
+
+    def _files(batch):
+        n = 0
+        for x in batch:
+            n += file_op(x)
+        return len(batch), n
+
+    r = _Progress(progress, progress_interval)
+    res = []
+    pending = set([pool.submit(_dir, '')])
+    while pending:
+        done, pending = concurrent.futures.wait(
+            pending,
+            timeout=progress_interval if progress else None,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for x in done:
+            x = x.result()
+            if len(x) == 2:
+                r.add(*x)
+                continue
+            res.append(x[0])
+            for d in x[1]:
+                pending.add(pool.submit(_dir, d))
+            f = x[2]
+            for i in range(0, len(f), _TREE_BATCH):
+                pending.add(pool.submit(_files, f[i:i + _TREE_BATCH]))
+        r.report()
+    r.report(force=True)
+    return res
+
+
+def _shutdown_pool(pool):
+    """Shutdown pool without waiting for or running queued work
+
+    Args:
+        pool (concurrent.futures.Executor): to shutdown
+    """
+    try:
+        pool.shutdown(wait=False, cancel_futures=True)
+    except TypeError:
+        # cancel_futures was added in Python 3.9
+        pool.shutdown(wait=False)
+
+
+def _sorted_scandir(dirname, want_stat):
+    """Sorted entries of dirname
+
+    Directories sort as if they had a trailing separator so a depth
+    first traversal yields paths in string order.
+
+    Args:
+        dirname (str): directory to read
+        want_stat (bool): stat files (follows symlinks)
+
+    Returns:
+        list: sorted (path, name, is_dir, stat) tuples; empty if dirname cannot be read
+    """
+    res = []
+    try:
+        for e in os.scandir(dirname):
+            try:
+                d = e.is_dir()
+            except OSError:
+                d = False
+            if d and e.is_symlink():
+                # os.walk does not follow or return links to directories
+                continue
+            s = None
+            if want_stat and not d:
+                try:
+                    s = e.stat()
+                except OSError:
+                    pass
+            res.append((e.name + os.sep if d else e.name, e.path, e.name, d, s))
+    except OSError:
+        return []
+    res.sort(key=lambda x: x[0])
+    return [x[1:] for x in res]
+
+
+def _stat_mtime_ns(value):
+    """Modification time in integer nanoseconds
+
+    Args:
+        value (object): os.stat_result or float seconds
+
+    Returns:
+        int: nanoseconds
+    """
+    if isinstance(value, float):
+        return int(value * 1e9)
+    return value.st_mtime_ns
+
+
+def _unchecked_unlink(filename):
+    """Remove filename ignoring OSError
+
+    Args:
+        filename (str): file to remove
+    """
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def _walk_tree(dirname, file_re, prune_re, relative, want_stat, schedule):
+    """Depth first traversal for `iter_tree` and `scan_tree`
+
+    Args:
+        dirname (str): directory to walk
+        file_re (re or str): only return files which match file_re
+        prune_re (re or str): do not descend into directories which match prune_re
+        relative (bool): yield paths relative to dirname
+        want_stat (bool): yield ``(path, stat)``
+        schedule (callable): called with a directory, returns a callable which returns `_sorted_scandir`
+
+    Yields:
+        object: path or (path, stat)
+    """
+    fr = _compile_re(file_re)
+    pr = _compile_re(prune_re)
+    stack = []
+
+    def _push(rel, entries):
+        i = []
+        for p, n, d, s in entries:
+            r = rel + n
+            if d:
+                if not (pr and pr.search(r)):
+                    # schedule before traversing so directories are read concurrently
+                    i.append((p, r + os.sep, schedule(p), None))
+            elif not fr or fr.search(r):
+                i.append((p, r, None, s))
+        stack.append(iter(i))
+
+    _push('', schedule(str(py_path(dirname).realpath()))())
+    while stack:
+        for p, r, entries, s in stack[-1]:
+            if entries:
+                _push(r, entries())
+                break
+            if relative:
+                p = r
+            yield (p, s) if want_stat else p
+        else:
+            stack.pop()
+
+
+def _watch_coalesce(events):
+    """Drop redundant events for the same path
+
+    Args:
+        events (list): (event, relative path) in order of occurrence
+
+    Returns:
+        list: coalesced events
+    """
+    res = []
+    last = {}
+    for x in events:
+        i = last.get(x[1])
+        if i is not None:
+            e = res[i][0]
+            if e == x[0] or e == WATCH_CREATE and x[0] == WATCH_MODIFY:
+                continue
+        last[x[1]] = len(res)
+        res.append(x)
+    return res
+
+
+def _watch_snapshot(root):
+    """Sizes and modification times of files in root
+
+    Args:
+        root (str): directory to scan
+
+    Returns:
+        dict: relative path to (size, mtime_ns)
+    """
+    return dict(
+        (r, (s.st_size, _stat_mtime_ns(s)) if s else None)
+        for r, s in scan_tree(root, relative=True, want_stat=True)
+    )
+
+
+def _zstandard():
+    """Import zstandard, which is optional
+
+    Returns:
+        module: zstandard
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstandard must be installed to read or write zst files')
+    return zstandard
+
+
+def _zstd_compressor(zstandard, level, threads):
+    """Create compressor
+
+    Args:
+        zstandard (module): zstandard
+        level (int): compression level [3]
+        threads (int): compression threads [1]
+
+    Returns:
+        zstandard.ZstdCompressor: compressor
+    """
+    return zstandard.ZstdCompressor(
+        level=3 if level is None else level,
+        threads=threads if threads and threads > 1 else 0,
+    )
+
+
+#: Implementations of `COPY_MODES`
+_COPY_OPS = dict(
+    copy=_copy_file,
+    hardlink=_hardlink_file,
+    reflink=lambda s, d: _copy_file(s, d, clone=True),
+)
+
+
+cfg = pkconfig.init(
+    chunk_size=(1 << 20, int, 'default buffer size for iter_chunks and iter_lines'),
+    scan_threads=(8, int, 'default size of thread pools for scan_tree, copy_tree, etc.'),
+)
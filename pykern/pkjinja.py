@@ -7,35 +7,116 @@ u"""Simplify rendering jinja2
 from __future__ import absolute_import, division, print_function
 from pykern.pkdebug import pkdc, pkdp
 
+import concurrent.futures
+import io
 import jinja2
+import locale
+import os
+import os.path
+import re
 
+from pykern import pkconfig
 from pykern import pkinspect
 from pykern import pkio
 from pykern import pkresource
 
+#: Batches with fewer jobs are rendered in this process by `render_batch`
+BATCH_PARALLEL_MIN = 8
 
-def render_file(filename, j2_ctx, output=None, strict_undefined=False):
+#: Size of the write buffer when rendering with stream
+STREAM_BUFFER_SIZE = 1 << 20
+
+#: Environments by their options (see `_environment`)
+_environments = {}
+
+
+class BatchError(Exception):
+    """Raised by `render_batch` after all jobs have run if any failed
+
+    Attributes:
+        errors (list): (output, message) for each failed job in job order
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super(BatchError, self).__init__(
+            '{} of the jobs failed; first: {}: {}'.format(len(errors), *errors[0]),
+        )
+
+
+def render_batch(jobs, processes=None, strict_undefined=False, stream=False):
+    """Render many templates concurrently in a process pool
+
+    Each template is compiled once in this process before the pool
+    starts so forked workers inherit the compiled code. If
+    cfg.bytecode_cache_dir is set, it is also written to the bytecode
+    cache (see `render_file`), so workers started with spawn or
+    forkserver load it instead of compiling. A failed job does not
+    stop the others. Small batches are rendered serially (see
+    `BATCH_PARALLEL_MIN`).
+
+    Args:
+        jobs (iterable): (template, j2_ctx, output); j2_ctx must be picklable
+        processes (int): size of process pool [os.cpu_count()]
+        strict_undefined (bool): set `jinja2.StrictUndefined` if True
+        stream (bool): see `render_file`
+
+    Returns:
+        list: py.path.local outputs in job order
+
+    Raises:
+        BatchError: aggregates all failures
+    """
+    j = [(str(t), c, str(o)) for t, c, o in jobs]
+    for t in set(x[0] for x in j):
+        try:
+            _template(t, strict_undefined)
+        except Exception:
+            # reported by the job
+            pass
+    n = min(processes or os.cpu_count() or 1, len(j))
+    a = [x + (strict_undefined, stream) for x in j]
+    if n < 2 or len(j) < BATCH_PARALLEL_MIN:
+        r = [_render_job(x) for x in a]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n) as p:
+            r = list(p.map(_render_job, a, chunksize=max(1, len(a) // (n * 4))))
+    e = [(o, m) for (t, c, o), m in zip(j, r) if m is not None]
+    if e:
+        raise BatchError(e)
+    return [pkio.py_path(x[2]) for x in j]
+
+
+def render_file(filename, j2_ctx, output=None, strict_undefined=False, stream=False):
     """Render filename as template with j2_ctx.
 
+    Compiled templates are cached for the life of the process and
+    recompiled when filename's mtime changes. If cfg.bytecode_cache_dir
+    is set, compiled code is also shared across processes through
+    that directory.
+
+    With stream, output is written as it is generated through a
+    `STREAM_BUFFER_SIZE` buffer so memory does not depend on the size
+    of the output. Compressed outputs (see `pkio.COMPRESSION_EXTENSIONS`)
+    are compressed as they are written.
+
     Args:
         basename (str): name without jinja extension
         j2_ctx (dict): how to replace values in Jinja2 template
         output (str): file name of output; if None, return str
         strict_undefined (bool): set `jinja2.StrictUndefined` if True
+        stream (bool): write output incrementally (output required) [False]
 
     Returns:
-        str: rendered template
+        str: rendered template (py.path.local: output if stream)
     """
-    t = pkio.read_text(filename)
-    kw = dict(
-        trim_blocks=True,
-        lstrip_blocks=True,
-        keep_trailing_newline=True,
-    )
-    if strict_undefined:
-        kw['undefined'] = jinja2.StrictUndefined
-    je = jinja2.Environment(**kw)
-    res = je.from_string(t).render(j2_ctx)
+    t = _template(filename, strict_undefined)
+    if stream:
+        assert output, \
+            'output required when stream is True'
+        with _open_output(output) as f:
+            t.stream(j2_ctx).dump(f)
+        return pkio.py_path(output)
+    res = t.render(j2_ctx)
     if output:
         pkio.write_text(output, res)
     return res
@@ -53,3 +134,138 @@ def render_resource(basename, *args, **kwargs):
         *args,
         **kwargs
     )
+
+
+def render_tree(src_dir, j2_ctx, dst_dir, file_re=r'\.jinja$', dst_name=None, **kwargs):
+    """Render all templates in src_dir to the same paths in dst_dir with `render_batch`
+
+    Args:
+        src_dir (str or py.path): templates, searched recursively
+        j2_ctx (dict): values for every template
+        dst_dir (str or py.path): where outputs are written (directories created)
+        file_re (str): matches templates; removed from output names [``\\.jinja$``]
+        dst_name (callable): maps relative output path to new relative path [None]
+        kwargs (dict): passed to `render_batch`
+
+    Returns:
+        list: py.path.local outputs sorted by template
+    """
+    s = str(pkio.py_path(src_dir))
+    d = pkio.py_path(dst_dir)
+    jobs = []
+    for t in pkio.walk_tree(s, file_re=file_re):
+        o = re.sub(file_re, '', t.relto(s))
+        o = d.join(dst_name(o) if dst_name else o)
+        pkio.mkdir_parent_only(o)
+        jobs.append((t, j2_ctx, o))
+    return render_batch(jobs, **kwargs)
+
+
+def _environment(strict_undefined):
+    """Environment for options, created once
+
+    Args:
+        strict_undefined (bool): set `jinja2.StrictUndefined` if True
+
+    Returns:
+        jinja2.Environment: shared environment
+    """
+    kw = dict(
+        trim_blocks=True,
+        lstrip_blocks=True,
+        keep_trailing_newline=True,
+    )
+    if strict_undefined:
+        kw['undefined'] = jinja2.StrictUndefined
+    k = tuple(sorted(kw.items()))
+    res = _environments.get(k)
+    if res is None:
+        if cfg.bytecode_cache_dir:
+            kw['bytecode_cache'] = jinja2.FileSystemBytecodeCache(
+                str(pkio.mkdir_parent(cfg.bytecode_cache_dir)),
+            )
+        res = jinja2.Environment(
+            auto_reload=True,
+            cache_size=cfg.cache_size,
+            loader=_FileLoader(),
+            **kw
+        )
+        _environments[k] = res
+    return res
+
+
+def _open_output(output):
+    """Open output for streamed writes with preferred encoding
+
+    Args:
+        output (str or py.path): file to write
+
+    Returns:
+        file: text file object
+    """
+    fn = str(output)
+    e = locale.getpreferredencoding()
+    if pkio.has_file_extension(fn, pkio.COMPRESSION_EXTENSIONS):
+        return io.TextIOWrapper(
+            io.BufferedWriter(pkio.open_compressed(fn, 'wb'), STREAM_BUFFER_SIZE),
+            encoding=e,
+        )
+    return io.open(fn, 'w', encoding=e, buffering=STREAM_BUFFER_SIZE)
+
+
+def _render_job(args):
+    """Render one `render_batch` job
+
+    Args:
+        args (tuple): template, j2_ctx, output, strict_undefined, stream
+
+    Returns:
+        str: error message or None
+    """
+    try:
+        render_file(
+            args[0],
+            args[1],
+            output=args[2],
+            strict_undefined=args[3],
+            stream=args[4],
+        )
+    except Exception as e:
+        return '{}: {}: {}'.format(args[0], type(e).__name__, e)
+    return None
+
+
+def _template(filename, strict_undefined):
+    """Compiled template from the cache
+
+    Args:
+        filename (str or py.path): template file
+        strict_undefined (bool): set `jinja2.StrictUndefined` if True
+
+    Returns:
+        jinja2.Template: template
+    """
+    return _environment(strict_undefined).get_template(
+        os.path.abspath(str(filename)),
+    )
+
+
+class _FileLoader(jinja2.BaseLoader):
+    """Loads absolute paths with `pkio.read_text` and revalidates by mtime"""
+
+    def get_source(self, environment, template):
+        m = os.path.getmtime(template)
+
+        def _uptodate():
+            try:
+                return os.path.getmtime(template) == m
+            except OSError:
+                return False
+
+        return pkio.read_text(template), template, _uptodate
+
+
+cfg = pkconfig.init(
+    bytecode_cache_dir=(None, str, 'share compiled templates across processes in this directory'),
+    cache_size=(400, int, 'number of compiled templates cached per environment'),
+)
@@ -5,15 +5,224 @@ u"""JSON help
 :license: http://www.apache.org/licenses/LICENSE-2.0.html
 """
 from __future__ import absolute_import, division, print_function
+from pykern import pkconfig
+import array
+import base64
+import codecs
+import collections
+import datetime
+import hashlib
+import io
+import itertools
+import math
+import os
+import re
+import sys
+import threading
+import time
 
+#: Single key of the object which replaces an array in base64 or sidecar mode
+ARRAY_KEY = '__pkjson_array__'
 
-def dump_pretty(obj, filename=None, pretty=True):
+#: How `dump_pretty` writes numpy.ndarray and array.array
+ARRAY_MODES = ('base64', 'list', 'sidecar')
+
+#: Default hashlib algorithm for `canonical_hash`
+CANONICAL_HASH_ALGORITHM = 'sha256'
+
+#: Libraries tried in order when backend is "auto"
+BACKENDS = ('orjson', 'rapidjson', 'ujson', 'json')
+
+#: Default number of characters (or bytes) read at a time by `iter_load`
+ITER_LOAD_CHUNK_SIZE = 1 << 16
+
+#: Smallest number of bytes parsed by each process in `load_lines_parallel`
+LINES_PARALLEL_MIN_CHUNK = 1 << 20
+
+#: Characters hashed at a time by `canonical_hash`
+_CANONICAL_CHUNK = 1 << 16
+
+#: Integral floats smaller than this are written as ints by `iter_canonical`
+_CANONICAL_INT_MAX = float(1 << 53)
+
+#: Characters which may follow a complete value in an array or object
+_DELIMITERS = frozenset(',]} \t\n\r')
+
+#: array.array typecodes by numpy dtype kind and itemsize (e.g. i4), smallest C type wins
+_TYPECODES = dict(
+    ('{}{}'.format('u' if c.isupper() else 'i', array.array(c).itemsize), c)
+    for c in reversed('bBhHiIlLqQ')
+)
+_TYPECODES.update(f4='f', f8='d')
+
+#: JSON insignificant whitespace
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class LinesAppender(object):
+    """Append compact JSON lines (NDJSON) to a file with buffered writes
+
+    Lines are buffered and written in a single append when
+    flush_lines are buffered or flush_interval seconds after the first
+    line is buffered. One thread (started with the first line) does the
+    latter so lines are written even if the caller stops appending.
+    Readers never see a partial line unless the process crashes in the
+    middle of a write::
+
+        with pkjson.LinesAppender('metrics.ndjson') as a:
+            for s in steps:
+                a.append(dict(step=s.n, energy=s.energy))
+
+    Args:
+        filename (str or py.path): file to append to (created if necessary)
+        flush_interval (float): maximum seconds a line is buffered [1.0]
+        flush_lines (int): maximum number of lines buffered [1000]
+    """
+    def __init__(self, filename, flush_interval=1.0, flush_lines=1000):
+        from pykern import pkio
+
+        self.filename = pkio.py_path(filename)
+        self.flush_interval = flush_interval
+        self.flush_lines = flush_lines
+        self._buf = []
+        self._file = io.open(str(self.filename), 'ab')
+        self._cond = threading.Condition()
+        self._deadline = None
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def append(self, obj):
+        """Buffer obj as a compact JSON line
+
+        Args:
+            obj (object): any Python object
+        """
+        import json
+
+        l = json.dumps(obj, separators=(',', ':'), default=_Encoder('list', None))
+        with self._cond:
+            self._buf.append(l)
+            if len(self._buf) >= self.flush_lines:
+                self._flush()
+            elif self._deadline is None:
+                self._deadline = time.monotonic() + self.flush_interval
+                if not self._thread:
+                    self._thread = threading.Thread(target=self._timed_flush)
+                    self._thread.daemon = True
+                    self._thread.start()
+                self._cond.notify()
+
+    def close(self):
+        """Flush and close file"""
+        with self._cond:
+            if self._file:
+                self._flush()
+                self._file.close()
+                self._file = None
+                self._cond.notify()
+
+    def flush(self):
+        """Write buffered lines"""
+        with self._cond:
+            self._flush()
+
+    def _flush(self):
+        self._deadline = None
+        if self._buf:
+            self._buf.append('')
+            self._file.write('\n'.join(self._buf).encode('utf-8'))
+            self._buf = []
+        self._file.flush()
+
+    def _timed_flush(self):
+        with self._cond:
+            while self._file:
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                t = self._deadline - time.monotonic()
+                if t > 0:
+                    self._cond.wait(t)
+                else:
+                    self._flush()
+
+
+def canonical_dumps(obj):
+    """Stable compact JSON for equality checks and cache keys
+
+    See `iter_canonical` for the format.
+
+    Args:
+        obj (object): JSON-like value
+
+    Returns:
+        str: canonical JSON
+    """
+    return ''.join(iter_canonical(obj))
+
+
+def canonical_hash(obj, algorithm=CANONICAL_HASH_ALGORITHM):
+    """Digest of `canonical_dumps` without building the string
+
+    Chunks from `iter_canonical` are hashed as they are produced so
+    memory is proportional to the depth of obj, not its size::
+
+        k = pkjson.canonical_hash(sim_input)
+        if k not in cache:
+            cache[k] = run(sim_input)
+
+    Args:
+        obj (object): JSON-like value
+        algorithm (str): hashlib name [CANONICAL_HASH_ALGORITHM]
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.new(algorithm)
+    b = []
+    n = 0
+    for c in iter_canonical(obj):
+        b.append(c)
+        n += len(c)
+        if n >= _CANONICAL_CHUNK:
+            h.update(''.join(b).encode('utf-8'))
+            b = []
+            n = 0
+    h.update(''.join(b).encode('utf-8'))
+    return h.hexdigest()
+
+
+def dump_pretty(obj, filename=None, pretty=True, atomic=False, fsync=True, arrays='list'):
     """Formats as json as string
 
+    numpy.ndarray and array.array are converted with tolist (in C) in
+    list mode. In base64 mode, integer and float arrays are replaced
+    with ``{ARRAY_KEY: {"base64": ..., "dtype": "<f8", "shape": [3]}}``.
+    sidecar mode is like base64, except the raw bytes are written to
+    ``<filename>.<n>.bin`` and the object contains "file" instead of
+    "base64". Use ``load_any(..., arrays=True)`` to restore them.
+
+    numpy scalars are converted to Python numbers and datetime,
+    date, and time are written with isoformat.
+
+    If pretty is False, the output comes from the fastest installed
+    library in `BACKENDS`. Its output may have no spaces and no ASCII
+    escapes. Values which a library cannot encode exactly (e.g. NaN
+    and Infinity, which orjson writes as null) are encoded with json.
+
     Args:
         obj (object): any Pyton object
         filename (str or py.path): where to write [None]
         pretty (bool): pretty print [True]
+        atomic (bool): write filename with `pkio.open_atomic` [False]
+        fsync (bool): if atomic, fsync filename and its directory [True]
+        arrays (str): one of `ARRAY_MODES` [list]
 
     Returns:
         str: sorted and formatted JSON
@@ -22,24 +231,650 @@ def dump_pretty(obj, filename=None, pretty=True):
     import json
     import py.path
 
+    assert arrays in ARRAY_MODES, \
+        '{}: arrays must be one of {}'.format(arrays, ARRAY_MODES)
+    assert filename or arrays != 'sidecar', \
+        'filename required for arrays=sidecar'
     if pretty:
-        res = json.dumps(obj, indent=4, separators=(',', ': '), sort_keys=True) + '\n'
+        # Always json so output is byte-identical across backends
+        e = _Encoder(arrays, filename)
+        res = json.dumps(
+            obj,
+            indent=4,
+            separators=(',', ': '),
+            sort_keys=True,
+            default=e,
+        ) + '\n'
     else:
-        res = json.dumps(obj)
+        res = None
+        b = _backend()
+        if b.dumps:
+            try:
+                e = _Encoder(arrays, filename)
+                res = b.dumps(obj, e, arrays == 'list')
+                if 'null' in res and _non_finite(obj):
+                    # NaN or Infinity was written as null
+                    res = None
+            except (OverflowError, TypeError, ValueError):
+                # json may still be able to encode (e.g. int keys, big ints)
+                pass
+        if res is None:
+            e = _Encoder(arrays, filename)
+            res = json.dumps(obj, default=e)
+    for f, b in e.sidecars:
+        # Before filename so it never references a missing file
+        with (pkio.open_atomic(f, 'wb', fsync=fsync) if atomic else io.open(f, 'wb')) as o:
+            o.write(b)
     if filename:
-        pkio.py_path(filename).write(res)
+        if atomic:
+            pkio.write_text(filename, res, atomic=True, fsync=fsync)
+        else:
+            pkio.py_path(filename).write(res)
     return res
 
 
-def load_any(obj):
-    """Calls `pkcollections.json_load_any`
+def iter_canonical(obj):
+    """Generate canonical JSON in chunks
+
+    Object keys (which must be str) are sorted, there is no
+    whitespace, strings are not ASCII-escaped, and tuples are lists.
+    Integral floats (including -0.0) are written as ints so 1.0 and 1
+    hash the same; other floats use the shortest repr that round
+    trips. NaN and Infinity are rejected. `pkcollections.OrderedMapping`
+    (e.g. from `pkconfig.init`) is an object. numpy, array.array, and
+    datetime values are converted as in `dump_pretty`. Nesting does not
+    recurse so depth is not limited by the stack.
+
+    Args:
+        obj (object): JSON-like value
+
+    Yields:
+        str: pieces of canonical JSON
+    """
+    from pykern import pkcollections
+    import json.encoder
+
+    q = json.encoder.encode_basestring
+    e = _Encoder('list', None)
+    stack = [(iter((('', obj),)), '')]
+    while stack:
+        d = len(stack)
+        for p, v in stack[d - 1][0]:
+            if p:
+                yield p
+            while True:
+                if isinstance(v, str):
+                    yield q(v)
+                elif v is None:
+                    yield 'null'
+                elif v is True:
+                    yield 'true'
+                elif v is False:
+                    yield 'false'
+                elif isinstance(v, int):
+                    yield int.__repr__(v)
+                elif isinstance(v, float):
+                    yield _canonical_float(v)
+                elif isinstance(v, dict):
+                    if not v:
+                        yield '{}'
+                        break
+                    yield '{'
+                    stack.append((_canonical_items(v, q), '}'))
+                elif isinstance(v, (list, tuple)):
+                    if all(type(x) in (int, float) for x in v):
+                        # Common case: vector of numbers
+                        yield '[' + ','.join(map(_canonical_number, v)) + ']'
+                        break
+                    yield '['
+                    stack.append((zip(itertools.chain(('',), itertools.repeat(',')), v), ']'))
+                elif isinstance(v, pkcollections.OrderedMapping):
+                    v = pkcollections.map_to_dict(v)
+                    continue
+                else:
+                    v = e(v)
+                    continue
+                break
+            if len(stack) > d:
+                # Descend; this iterator continues after the container
+                break
+        else:
+            yield stack.pop()[1]
+
+
+def iter_load(obj, chunk_size=ITER_LOAD_CHUNK_SIZE, object_pairs_hook=None):
+    """Parse top-level array elements or object items incrementally
+
+    Only the element being parsed (and one chunk) are held in memory
+    so documents larger than memory can be processed if their
+    top-level elements are not::
+
+        with pkio.open_compressed('run.json.gz') as f:
+            for k, v in pkjson.iter_load(f):
+                ...
+
+    Args:
+        obj (object): object with "read" returning str or bytes (e.g. file or mmap), or str
+        chunk_size (int): initial amount to read at a time [ITER_LOAD_CHUNK_SIZE]
+        object_pairs_hook (callable): passed to json [`pkcollections.object_pairs_hook`]
+
+    Yields:
+        object: array element or (key, value) for object
+    """
+    import json
+    from pykern import pkcollections
+
+    d = json.JSONDecoder(
+        object_pairs_hook=object_pairs_hook or pkcollections.object_pairs_hook,
+    )
+    r = _StreamReader(obj, chunk_size)
+    c = r.skip()
+    if c == '{':
+        end = '}'
+    elif c == '[':
+        end = ']'
+    else:
+        raise ValueError('{}: top-level value must be an array or object'.format(c))
+    r.pos += 1
+    if r.skip() == end:
+        return
+    while True:
+        if end == '}':
+            k = r.decode(d)
+            if r.skip() != ':':
+                raise ValueError('{}: expecting ":" after object key'.format(k))
+            r.pos += 1
+            r.skip()
+            yield k, r.decode(d)
+        else:
+            yield r.decode(d)
+        c = r.skip()
+        r.pos += 1
+        if c == end:
+            return
+        if c != ',':
+            raise ValueError('{}: expecting "," or "{}"'.format(c, end))
+        r.skip()
+
+
+def iter_lines(obj, object_pairs_hook=None):
+    """Parse JSON lines (NDJSON) one at a time
+
+    Blank lines are skipped. Files are read with `pkio.iter_lines` so
+    compressed files are decompressed.
+
+    Args:
+        obj (object): file name or object which iterates lines
+        object_pairs_hook (callable): passed to json [`pkcollections.object_pairs_hook`]
+
+    Yields:
+        object: parsed line
+    """
+    import json
+    from pykern import pkcollections
+    from pykern import pkio
+    import py.path
+
+    d = json.JSONDecoder(
+        object_pairs_hook=object_pairs_hook or pkcollections.object_pairs_hook,
+    )
+    b = _backend() if object_pairs_hook is None else None
+    if isinstance(obj, (str, py.path.local)):
+        obj = pkio.iter_lines(obj)
+    for l in obj:
+        if isinstance(l, bytes):
+            l = l.decode('utf-8')
+        l = l.strip()
+        if l:
+            yield _loads(b, l) if b and b.loads else d.decode(l)
+
+
+def load_any(obj, arrays=False):
+    """Parse with the configured backend into `pkcollections.Dict`
+
+    Falls back to `pkcollections.json_load_any` when there is no
+    faster backend or it rejects the input (e.g. NaN or big ints).
+
+    With arrays, objects written by `dump_pretty` in base64 or
+    sidecar mode are restored as numpy.ndarray or, if numpy is not
+    installed, one-dimensional array.array. Sidecar files are
+    relative to the directory of obj (py.path or file), else the
+    current directory.
 
     Args:
-        obj (object): str or object with "read"
+        obj (object): str, bytes, memoryview, or object with "read" (e.g. `pkio.open_mmap`)
+        arrays (bool): restore typed arrays [False]
 
     Returns:
         object: parsed JSON
     """
     from pykern import pkcollections
 
-    return pkcollections.json_load_any(obj)
+    h = _ArrayHook(obj) if arrays else pkcollections.object_pairs_hook
+    b = _backend()
+    if not b.loads:
+        return pkcollections.json_load_any(obj, object_pairs_hook=h)
+    return _loads(b, obj.read() if hasattr(obj, 'read') else obj, h)
+
+
+def load_lines_parallel(filename, processes=None, object_pairs_hook=None):
+    """Parse a JSON lines (NDJSON) file in a process pool
+
+    The file is split into byte ranges on line boundaries, which are
+    parsed concurrently. Compressed and small files are parsed with
+    `iter_lines` in this process.
+
+    Args:
+        filename (str or py.path): file to read
+        processes (int): size of process pool [os.cpu_count()]
+        object_pairs_hook (callable): module-level function passed to json [`pkcollections.object_pairs_hook`]
+
+    Returns:
+        list: parsed lines in file order
+    """
+    import concurrent.futures
+    from pykern import pkio
+
+    fn = str(pkio.py_path(filename))
+    s = os.path.getsize(fn)
+    n = min(processes or os.cpu_count() or 1, s // LINES_PARALLEL_MIN_CHUNK)
+    if n < 2 or pkio.has_file_extension(fn, pkio.COMPRESSION_EXTENSIONS):
+        return list(iter_lines(fn, object_pairs_hook=object_pairs_hook))
+    b = [0]
+    with io.open(fn, 'rb') as f:
+        for i in range(1, n):
+            f.seek(max(b[-1], s * i // n))
+            f.readline()
+            b.append(f.tell())
+    b.append(s)
+    res = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n) as p:
+        for x in p.map(
+            _load_lines_range,
+            [fn] * n,
+            b[:-1],
+            b[1:],
+            [object_pairs_hook] * n,
+        ):
+            res.extend(x)
+    return res
+
+
+def _backend():
+    """Import the configured backend once
+
+    Returns:
+        _Backend: dumps and loads are None for json
+    """
+    global _backend_cache
+
+    if _backend_cache:
+        return _backend_cache
+    for n in BACKENDS if cfg.backend == 'auto' else (cfg.backend,):
+        try:
+            m = __import__(n)
+        except ImportError:
+            continue
+        _backend_cache = _BACKEND_OPS[n](m)
+        return _backend_cache
+    raise AssertionError('{}: backend not installed'.format(cfg.backend))
+
+
+def _canonical_float(value):
+    """Integral as int else shortest repr; NaN and Infinity are errors"""
+    if value.is_integer():
+        if abs(value) < _CANONICAL_INT_MAX:
+            return str(int(value))
+    elif value != value:
+        raise ValueError('NaN is not allowed in canonical JSON')
+    if value in (float('inf'), float('-inf')):
+        raise ValueError('{}: Infinity is not allowed in canonical JSON'.format(value))
+    return float.__repr__(value)
+
+
+def _canonical_items(value, quote):
+    """Sorted (prefix, value) for `iter_canonical`"""
+    k = sorted(value)
+    for x in k:
+        if not isinstance(x, str):
+            raise TypeError('{!r}: canonical JSON keys must be str'.format(x))
+    return zip(
+        (('' if i == 0 else ',') + quote(x) + ':' for i, x in enumerate(k)),
+        (value[x] for x in k),
+    )
+
+
+def _canonical_number(value):
+    """Format int or float in a vector"""
+    return int.__repr__(value) if type(value) is int else _canonical_float(value)
+
+
+def _cfg_backend(value):
+    """Validate backend name
+
+    Args:
+        value (str): "auto" or one of `BACKENDS`
+
+    Returns:
+        str: validated name
+    """
+    assert value == 'auto' or value in BACKENDS, \
+        '{}: backend must be auto or one of {}'.format(value, BACKENDS)
+    return value
+
+
+def _load_lines_range(filename, start, end, object_pairs_hook):
+    """Parse lines which start in [start, end) for `load_lines_parallel`
+
+    Args:
+        filename (str): file to read
+        start (int): offset of first line
+        end (int): offset after last line
+        object_pairs_hook (callable): passed to json
+
+    Returns:
+        list: parsed lines
+    """
+    with io.open(filename, 'rb') as f:
+        f.seek(start)
+        return list(iter_lines(io.BytesIO(f.read(end - start)), object_pairs_hook))
+
+
+def _loads(backend, value, object_pairs_hook=None):
+    """Parse with backend and convert objects with object_pairs_hook
+
+    Args:
+        backend (_Backend): has a loads
+        value (object): str, bytes, bytearray, or memoryview
+        object_pairs_hook (callable): [`pkcollections.object_pairs_hook`]
+
+    Returns:
+        object: parsed JSON
+    """
+    from pykern import pkcollections
+
+    h = object_pairs_hook or pkcollections.object_pairs_hook
+    try:
+        v = backend.loads(value)
+    except (OverflowError, ValueError):
+        # json accepts NaN, Infinity, and big ints; it also gives better errors
+        return pkcollections.json_load_any(value, object_pairs_hook=h)
+    if not isinstance(v, (dict, list)):
+        return v
+    # Top-down so deeply nested values do not recurse
+    res = [None]
+    stack = [(res, 0, v)]
+    while stack:
+        p, k, v = stack.pop()
+        if isinstance(v, dict):
+            v = h(list(v.items()))
+            p[k] = v
+            if not isinstance(v, dict):
+                # e.g. a restored array
+                continue
+            i = v.items()
+        else:
+            i = enumerate(v)
+            p[k] = v
+        stack.extend((v, k2, v2) for k2, v2 in i if isinstance(v2, (dict, list)))
+    return res[0]
+
+
+def _non_finite(value):
+    """Does value contain NaN or Infinity
+
+    Args:
+        value (object): what is being encoded
+
+    Returns:
+        bool: True if a float (or float array element) is not finite
+    """
+    n = sys.modules.get('numpy')
+    s = [value]
+    while s:
+        v = s.pop()
+        if isinstance(v, float):
+            if not math.isfinite(v):
+                return True
+        elif isinstance(v, dict):
+            s.extend(v.values())
+        elif isinstance(v, (list, tuple)):
+            s.extend(v)
+        elif isinstance(v, array.array):
+            if v.typecode in 'fd' and not all(map(math.isfinite, v)):
+                return True
+        elif n and isinstance(v, (n.ndarray, n.generic)):
+            if v.dtype.kind in 'fc' and not n.isfinite(v).all():
+                return True
+    return False
+
+
+def _orjson(m):
+    """Wrap orjson module in a `_Backend`"""
+    return _Backend(
+        'orjson',
+        lambda obj, default, numpy: m.dumps(
+            obj,
+            default=default,
+            option=m.OPT_SERIALIZE_NUMPY if numpy else 0,
+        ).decode('utf-8'),
+        m.loads,
+    )
+
+
+def _rapidjson(m):
+    """Wrap rapidjson module in a `_Backend`"""
+    return _Backend(
+        'rapidjson',
+        lambda obj, default, numpy: m.dumps(obj, default=default),
+        # rapidjson only parses str and bytes
+        lambda value: m.loads(
+            bytes(value) if isinstance(value, (bytearray, memoryview)) else value,
+        ),
+    )
+
+
+def _ujson(m):
+    """Wrap ujson module in a `_Backend`"""
+    return _Backend(
+        'ujson',
+        lambda obj, default, numpy: m.dumps(
+            obj,
+            default=default,
+            escape_forward_slashes=False,
+        ),
+        lambda value: m.loads(
+            bytes(value) if isinstance(value, (bytearray, memoryview)) else value,
+        ),
+    )
+
+
+class _ArrayHook(object):
+    """object_pairs_hook which restores arrays for `load_any`
+
+    Args:
+        obj (object): what is being parsed; locates sidecar files
+    """
+
+    def __init__(self, obj):
+        d = getattr(obj, 'dirname', None)
+        if d is None:
+            n = getattr(obj, 'name', None)
+            d = os.path.dirname(n) if isinstance(n, str) else ''
+        self._dirname = str(d)
+
+    def __call__(self, pairs):
+        from pykern import pkcollections
+
+        if len(pairs) != 1 or pairs[0][0] != ARRAY_KEY:
+            return pkcollections.object_pairs_hook(pairs)
+        v = pairs[0][1]
+        if 'base64' in v:
+            b = base64.b64decode(v['base64'])
+        else:
+            with io.open(os.path.join(self._dirname, v['file']), 'rb') as f:
+                b = f.read()
+        try:
+            import numpy
+        except ImportError:
+            return self._array(b, v['dtype'], v['shape'])
+        return numpy.frombuffer(bytearray(b), dtype=v['dtype']).reshape(v['shape'])
+
+    def _array(self, value, dtype, shape):
+        """Convert to array.array when numpy is not installed"""
+        c = _TYPECODES.get(dtype[1:])
+        if c is None or len(shape) != 1:
+            raise ValueError(
+                '{} {}: numpy required to restore array'.format(dtype, shape),
+            )
+        res = array.array(c)
+        res.frombytes(value)
+        if dtype[0] == ('>' if sys.byteorder == 'little' else '<'):
+            res.byteswap()
+        return res
+
+
+class _Encoder(object):
+    """json default which converts numpy, array.array, and datetime for `dump_pretty`
+
+    Args:
+        arrays (str): one of `ARRAY_MODES`
+        filename (str or py.path): JSON file (for sidecar names)
+    """
+
+    def __init__(self, arrays, filename):
+        self.arrays = arrays
+        self.filename = str(filename) if filename else None
+        #: (path, bytes) to write in sidecar mode
+        self.sidecars = []
+
+    def __call__(self, obj):
+        if isinstance(obj, (datetime.date, datetime.time)):
+            return obj.isoformat()
+        if isinstance(obj, array.array):
+            if self.arrays == 'list' or obj.typecode == 'u':
+                return obj.tolist()
+            return self._array(
+                obj.tobytes(),
+                '{}{}{}'.format(
+                    '<' if sys.byteorder == 'little' else '>',
+                    'f' if obj.typecode in 'fd' else 'u' if obj.typecode.isupper() else 'i',
+                    obj.itemsize,
+                ),
+                [len(obj)],
+            )
+        # Only check numpy if it has been imported by the caller
+        n = sys.modules.get('numpy')
+        if n:
+            if isinstance(obj, n.ndarray):
+                if self.arrays == 'list' or obj.dtype.kind not in 'biuf':
+                    return obj.tolist()
+                return self._array(
+                    n.ascontiguousarray(obj).tobytes(),
+                    obj.dtype.str,
+                    list(obj.shape),
+                )
+            if isinstance(obj, n.generic):
+                return obj.item()
+        raise TypeError(
+            '{}: type={} is not JSON serializable'.format(obj, type(obj)),
+        )
+
+    def _array(self, value, dtype, shape):
+        v = dict(dtype=dtype, shape=shape)
+        if self.arrays == 'base64':
+            v['base64'] = base64.b64encode(value).decode('ascii')
+        else:
+            f = '{}.{}.bin'.format(self.filename, len(self.sidecars))
+            self.sidecars.append((f, value))
+            v['file'] = os.path.basename(f)
+        return {ARRAY_KEY: v}
+
+
+class _StreamReader(object):
+    """Buffer for `iter_load`
+
+    Args:
+        obj (object): object with "read" or str
+        chunk_size (int): initial amount to read
+    """
+    def __init__(self, obj, chunk_size):
+        self.buf = ''
+        self.eof = True
+        self.pos = 0
+        if hasattr(obj, 'read'):
+            self.eof = False
+            self._chunk_size = chunk_size
+            self._decoder = codecs.getincrementaldecoder('utf-8')()
+            self._obj = obj
+        else:
+            self.buf = obj.decode('utf-8') if isinstance(obj, bytes) else obj
+
+    def decode(self, decoder):
+        """Decode value at pos, reading more until it is complete
+
+        A value is complete if it is followed by a delimiter, which is
+        always true inside a top-level array or object. Otherwise, a
+        number could be split across reads.
+
+        Args:
+            decoder (json.JSONDecoder): to use
+
+        Returns:
+            object: value
+        """
+        n = self._chunk_size if not self.eof else None
+        while True:
+            try:
+                v, e = decoder.raw_decode(self.buf, self.pos)
+                if self.eof or e < len(self.buf) and self.buf[e] in _DELIMITERS:
+                    self.pos = e
+                    return v
+            except ValueError:
+                if self.eof:
+                    raise
+            # Read geometrically more so large values are not reparsed often
+            self._read(n)
+            n *= 2
+
+    def skip(self):
+        """Skip whitespace
+
+        Returns:
+            str: next character
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise ValueError('unexpected end of JSON')
+            self._read(self._chunk_size)
+
+    def _read(self, size):
+        b = self._obj.read(size)
+        # Raw bytes, because a partial character decodes to ''
+        if not b:
+            self.eof = True
+        if isinstance(b, bytes):
+            b = self._decoder.decode(b, final=self.eof)
+        self.buf = self.buf[self.pos:] + b
+        self.pos = 0
+
+
+#: name, compact encoder(obj, default, numpy), and decoder of a fast json library
+_Backend = collections.namedtuple('_Backend', 'name dumps loads')
+
+_BACKEND_OPS = dict(
+    json=lambda m: _Backend('json', None, None),
+    orjson=_orjson,
+    rapidjson=_rapidjson,
+    ujson=_ujson,
+)
+
+#: Selected by `_backend`
+_backend_cache = None
+
+cfg = pkconfig.init(
+    backend=('auto', _cfg_backend, 'json library: auto, ' + ', '.join(BACKENDS)),
+)
@@ -8,29 +8,221 @@ from __future__ import absolute_import, division, print_function
 
 # Root module: Import only builtin packages so avoid dependency issues
 import errno
-import inspect
+import importlib
+import io
+import mmap
 import os.path
-import pkg_resources
-import re
+import pathlib
+import struct
+import sys
 
 from pykern import pkinspect
-from pykern import pksetup
+
+#POSIT: same as pksetup.PACKAGE_DATA, which is not imported, because
+# pksetup imports pkg_resources and pip, which are slow to import
+#: The subdirectory in the top-level Python where to put resources
+PACKAGE_DATA = 'package_data'
+
+#: Read-only maps of zip archives by path for `read_memoryview`
+_archives = {}
+
+#: Fixed size part of a zip local file header (name and extra lengths at 26)
+_ZIP_LOCAL_HEADER = struct.Struct('<26xHH')
+
+#: Resolved paths by (root package, relative_filename)
+_paths = {}
 
 
 def filename(relative_filename, caller_context=None):
     """Return the filename to the resource
 
+    Paths are found with :mod:`importlib.resources` (or the directory
+    of a module which is not a package) and memoized so subsequent
+    calls do not touch the filesystem. The caller is found from the
+    module name of the calling frame, which is much cheaper than
+    :mod:`inspect`. Resources in zipped packages are extracted to
+    temporary files, which remain until exit (see `read_bytes` to avoid
+    extraction).
+
     Args:
         relative_filename (str): file name relative to package_data directory.
         caller_context (object): Any object from which to get the `root_package`
+            or the name of the package, which avoids inspecting the stack
 
     Returns:
         str: absolute path of the resource file
     """
-    pkg = pkinspect.root_package(
-        caller_context if caller_context else pkinspect.caller_module())
-    fn = os.path.join(pksetup.PACKAGE_DATA, relative_filename)
-    res = pkg_resources.resource_filename(pkg, fn)
+    pkg = _root_package(caller_context)
+    k = (pkg, relative_filename)
+    res = _paths.get(k)
+    if res is not None:
+        return res
+    res = _filename(pkg, relative_filename)
     if not os.path.exists(res):
         raise IOError((errno.ENOENT, 'resource does not exist', res))
+    _paths[k] = res
+    return res
+
+
+def open_binary(relative_filename, caller_context=None):
+    """Open resource as a binary stream without extracting it
+
+    Zipped resources are decompressed as they are read.
+
+    Args:
+        relative_filename (str): file name relative to package_data directory.
+        caller_context (object): see `filename`
+
+    Returns:
+        file: binary file object
+    """
+    return _resource(relative_filename, caller_context).open('rb')
+
+
+def read_bytes(relative_filename, caller_context=None):
+    """Contents of resource, read directly from a zip archive if zipped
+
+    Args:
+        relative_filename (str): file name relative to package_data directory.
+        caller_context (object): see `filename`
+
+    Returns:
+        bytes: contents
+    """
+    return _resource(relative_filename, caller_context).read_bytes()
+
+
+def read_memoryview(relative_filename, caller_context=None):
+    """Read-only view of resource contents without copying
+
+    Files and uncompressed (stored) zip members are views of a
+    memory map, which is shared by all resources in the same archive.
+    Compressed zip members must be decompressed so they are views of
+    `read_bytes`.
+
+    Args:
+        relative_filename (str): file name relative to package_data directory.
+        caller_context (object): see `filename`
+
+    Returns:
+        memoryview: contents
+    """
+    r = _resource(relative_filename, caller_context)
+    if hasattr(r, '__fspath__'):
+        with io.open(os.fspath(r), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # mmap does not allow empty maps
+                return memoryview(b'')
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    res = _zip_stored(r)
+    if res is None:
+        res = memoryview(r.read_bytes())
+    return res
+
+
+def _filename(pkg, relative_filename):
+    """Find path, extracting zipped resources
+
+    Args:
+        pkg (str): root package
+        relative_filename (str): file name relative to package_data
+
+    Returns:
+        str: path (may not exist)
+    """
+    p = _traversable(pkg, relative_filename)
+    if hasattr(p, '__fspath__'):
+        return os.fspath(p)
+    if not p.is_file():
+        return str(p)
+    import importlib.resources
+
+    # Not exited so the temporary file is valid for the life of the process
+    return os.fspath(importlib.resources.as_file(p).__enter__())
+
+
+def _resource(relative_filename, caller_context):
+    """Traversable for resource which must exist
+
+    Args:
+        relative_filename (str): file name relative to package_data directory.
+        caller_context (object): see `filename`
+
+    Returns:
+        object: Traversable
+    """
+    res = _traversable(_root_package(caller_context), relative_filename)
+    if not res.is_file():
+        raise IOError((errno.ENOENT, 'resource does not exist', str(res)))
+    return res
+
+
+def _root_package(caller_context):
+    """Root package from caller_context or caller module
+
+    Args:
+        caller_context (object): str, any object, or None
+
+    Returns:
+        str: root package name
+    """
+    if isinstance(caller_context, str):
+        return caller_context.split('.', 1)[0]
+    if caller_context:
+        return pkinspect.root_package(caller_context)
+    # Same as pkinspect.caller_module, without inspect.getmodule's search
+    f = sys._getframe(1)
+    while f.f_globals.get('__name__') == __name__:
+        f = f.f_back
+    return f.f_globals['__name__'].split('.', 1)[0]
+
+
+def _traversable(pkg, relative_filename):
+    """Resource as importlib.resources Traversable
+
+    Args:
+        pkg (str): root package
+        relative_filename (str): file name relative to package_data
+
+    Returns:
+        object: Traversable (pathlib.Path if not found by importlib.resources)
+    """
+    try:
+        import importlib.resources
+
+        res = importlib.resources.files(pkg)
+    except (ImportError, AttributeError, TypeError, ValueError):
+        # Module which is not a package (before python 3.12), no spec
+        # (e.g. __main__), or python before 3.9
+        m = sys.modules.get(pkg) or importlib.import_module(pkg)
+        res = pathlib.Path(os.path.dirname(os.path.abspath(m.__file__)))
+    res = res.joinpath(PACKAGE_DATA)
+    for x in relative_filename.split('/'):
+        res = res.joinpath(x)
     return res
+
+
+def _zip_stored(resource):
+    """View of an uncompressed zip member in the archive's memory map
+
+    Args:
+        resource (object): Traversable
+
+    Returns:
+        memoryview: contents or None if not a stored zip member
+    """
+    z = getattr(resource, 'root', None)
+    if z is None or not hasattr(z, 'getinfo'):
+        return None
+    i = z.getinfo(resource.at)
+    # ZIP_STORED and not encrypted
+    if i.compress_type != 0 or i.flag_bits & 1 or not i.file_size:
+        return None
+    m = _archives.get(z.filename)
+    if m is None:
+        with io.open(z.filename, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _archives[z.filename] = m
+    n, e = _ZIP_LOCAL_HEADER.unpack_from(m, i.header_offset)
+    o = i.header_offset + 30 + n + e
+    return memoryview(m)[o:o + i.file_size]
@@ -448,10 +448,18 @@ def _find_files(dirname):
         res = _git_ls_files(['--others', '--exclude-standard', dirname])
         res.extend(_git_ls_files([dirname]))
     else:
-        res = []
-        for r, _, files in os.walk(dirname):
-            for f in files:
-                res.append(os.path.join(r, f))
+        try:
+            # pkio depends on packages in requirements.txt
+            from pykern import pkio
+            res = [
+                os.path.join(dirname, f)
+                for f in pkio.scan_tree(dirname, relative=True)
+            ]
+        except ImportError:
+            res = []
+            for r, _, files in os.walk(dirname):
+                for f in files:
+                    res.append(os.path.join(r, f))
     return sorted(res)
 
 
@@ -73,13 +73,15 @@ def data_dir():
 def data_yaml(base_name):
     """Load base_name.yml from data_dir
 
+    The parse is cached (see `pkyaml.load_file`).
+
     Args:
         base_name (str): name of YAML file with ``.yml`` extension
 
     Returns:
         object: YAML data structure, usually dict or array
     """
-    return pkyaml.load_file(data_dir().join(base_name) + '.yml')
+    return pkyaml.load_file(data_dir().join(base_name) + '.yml', cache=True)
 
 
 def empty_work_dir():
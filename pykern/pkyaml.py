@@ -7,30 +7,91 @@ u"""Wrapper for :mod:`yaml`
 from __future__ import absolute_import, division, print_function
 from pykern import pkcollections
 from pykern import pkcompat
+from pykern import pkconfig
 from pykern import pkinspect
 from pykern import pkio
 from pykern import pkresource
+import os
+import pickle
 import py
+import time
 import yaml
 
+#: Appended to the YAML file name when cfg.persistent_cache is set
+PERSISTENT_CACHE_SUFFIX = '.pkyaml.pickle'
 
-def load_file(filename):
+#: Incremented when the persistent cache format changes
+_CACHE_VERSION = 1
+
+#: Parsed files by absolute path: ((mtime_ns, size), pickled value)
+_cache = {}
+
+#: Files modified more recently are not cached, since a write in the same mtime tick would be missed
+_CACHE_RACY_NS = 2 * 10 ** 9
+
+
+def iter_load(filename):
+    """Parse documents one at a time from a multi-document YAML file
+
+    Documents are separated by ``---``. The input is read as it is
+    parsed and each document is released when the caller moves on, so
+    only one document is in memory::
+
+        for j in pkyaml.iter_load('jobs.yml.gz'):
+            submit(j.name, j.params)
+
+    Empty documents (e.g. after a trailing ``---``) are skipped.
+
+    Args:
+        filename (str or object): file to read (may be compressed, see `pkio.open_text`)
+            or stream with ``read``
+
+    Yields:
+        object: `pkcollections.Dict`, list, or scalar
+    """
+    if hasattr(filename, 'read') and not isinstance(filename, py.path.local):
+        for d in yaml.load_all(filename, Loader=_Loader):
+            if d is not None:
+                yield d
+        return
+    with pkio.open_text(filename) as f:
+        for d in yaml.load_all(f, Loader=_Loader):
+            if d is not None:
+                yield d
+
+
+def load_file(filename, cache=False):
     """Read a file, making sure all keys and values are locale.
 
+    The file is parsed as a stream so its text is not held in memory.
+    Parsing uses LibYAML (``yaml.CSafeLoader``) if it is available.
+
+    With cache, the parsed value is kept for the life of the process
+    (and, if cfg.persistent_cache, in a pickle next to the file) and
+    only reparsed when the file's mtime or size changes. Each call
+    returns a new copy so callers may modify the result.
+
     Args:
-        filename (str): file to read (Note: ``.yml`` will not be appended)
+        filename (str or object): file to read (Note: ``.yml`` will not be appended)
+            or stream with ``read`` such as `pkio.open_mmap`
+        cache (bool): reuse previous parse of filename [False]
 
     Returns:
         object: `pkcollections.Dict` or list
     """
-    return _fixup(
-        yaml.load(pkio.read_text(filename)),
-    )
+    if hasattr(filename, 'read') and not isinstance(filename, py.path.local):
+        return yaml.load(filename, Loader=_Loader)
+    if cache:
+        return _load_cached(str(filename))
+    with pkio.open_text(filename) as f:
+        return yaml.load(f, Loader=_Loader)
 
 
 def load_resource(basename):
     """Read a resource, making sure all keys and values are locale
 
+    The parsed value is cached (see `load_file`).
+
     Args:
         basename (str): file to read without yml suffix
 
@@ -38,21 +99,97 @@ def load_resource(basename):
         object: `pkcollections.Dict` or list
     """
     return load_file(
-        pkresource.filename(basename + '.yml', pkinspect.caller_module()))
-
-
-def _fixup(obj):
-    """Convert all objects to locale strings"""
-    if isinstance(obj, dict):
-        res = pkcollections.Dict()
-        for k in obj:
-            res[pkcompat.locale_str(k)] = _fixup(obj[k])
-        return res
-    if isinstance(obj, list):
-        res = []
-        for v in obj:
-            res.append(_fixup(v))
-        return res
-    if type(obj) == bytes or type(obj) == str and hasattr(obj, 'decode'):
-        return pkcompat.locale_str(obj)
-    return obj
+        pkresource.filename(basename + '.yml', pkinspect.caller_module()),
+        cache=True,
+    )
+
+
+def _construct_map(loader, node):
+    """Mappings are `pkcollections.Dict` with locale keys
+
+    A generator so PyYAML fills nested collections from its own
+    queue instead of recursing.
+    """
+    res = pkcollections.Dict()
+    yield res
+    for k, v in loader.construct_mapping(node).items():
+        res[pkcompat.locale_str(k)] = v
+
+
+def _load_cached(filename):
+    """Parse filename unless (mtime, size) matches the cached parse
+
+    Copies are made by unpickling, which is much faster than
+    reparsing or `copy.deepcopy`. Recently modified files are parsed,
+    but not cached (see `_CACHE_RACY_NS`).
+
+    Args:
+        filename (str): YAML file
+
+    Returns:
+        object: new copy of parsed value
+    """
+    fn = os.path.abspath(filename)
+    s = os.stat(fn)
+    if s.st_mtime_ns > time.time_ns() - _CACHE_RACY_NS:
+        return load_file(fn)
+    k = (s.st_mtime_ns, s.st_size)
+    c = _cache.get(fn)
+    if c is None or c[0] != k:
+        b = cfg.persistent_cache and _persistent_read(fn, k)
+        if not b:
+            b = pickle.dumps(load_file(fn), pickle.HIGHEST_PROTOCOL)
+            if cfg.persistent_cache:
+                _persistent_write(fn, k, b)
+        c = (k, b)
+        _cache[fn] = c
+    return pickle.loads(c[1])
+
+
+def _persistent_read(filename, key):
+    """Pickled value from the persistent cache if valid
+
+    Args:
+        filename (str): YAML file
+        key (tuple): (mtime_ns, size) of filename
+
+    Returns:
+        bytes: pickled value or None
+    """
+    try:
+        with open(filename + PERSISTENT_CACHE_SUFFIX, 'rb') as f:
+            v = pickle.load(f)
+        if v[0] == _CACHE_VERSION and tuple(v[1]) == key:
+            return v[2]
+    except Exception:
+        # Missing, truncated, or from another version: reparse
+        pass
+    return None
+
+
+def _persistent_write(filename, key, value):
+    """Write the persistent cache unless directory is read-only
+
+    Args:
+        filename (str): YAML file
+        key (tuple): (mtime_ns, size) of filename
+        value (bytes): pickled value
+    """
+    try:
+        with pkio.open_atomic(filename + PERSISTENT_CACHE_SUFFIX, 'wb', fsync=False) as f:
+            pickle.dump((_CACHE_VERSION, key, value), f, pickle.HIGHEST_PROTOCOL)
+    except (IOError, OSError):
+        # e.g. resources installed in a read-only site-packages
+        pass
+
+
+class _Loader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+    """LibYAML safe loader (if available) which creates `pkcollections.Dict`"""
+    pass
+
+
+_Loader.add_constructor(u'tag:yaml.org,2002:map', _construct_map)
+
+cfg = pkconfig.init(
+    persistent_cache=(False, bool, 'pickle cached parses next to YAML files'),
+)
@@ -33,3 +33,172 @@ def test_new_float():
         'new_float with initializer, should be non-zero'
     assert float(5) == d[1], \
         'new_float should intitialize to a float'
+
+
+def test_new_ints():
+    for f, n, v in (
+        (pkarray.new_int32, 4, -(1 << 31)),
+        (pkarray.new_int64, 8, -(1 << 63)),
+        (pkarray.new_uint8, 1, 255),
+    ):
+        d = f([v])
+        assert n == d.itemsize, \
+            '{}: unexpected itemsize'.format(f.__name__)
+        assert v == d[0], \
+            '{}: should hold extreme value'.format(f.__name__)
+
+
+def test_bytes_and_files():
+    from pykern import pkunit
+
+    d = pkarray.new_double([1.5, -2])
+    assert d == pkarray.frombytes(d.tobytes()), \
+        'frombytes should restore tobytes'
+    assert d == pkarray.frombytes(memoryview(d)), \
+        'frombytes should accept typed memoryview'
+    fn = pkunit.empty_work_dir().join('d.bin')
+    pkarray.tofile(d, fn)
+    assert d == pkarray.fromfile(fn), \
+        'fromfile should read all elements'
+    assert d[:1] == pkarray.fromfile(fn, count=1), \
+        'fromfile should read count elements'
+
+
+def test_numpy():
+    np = pytest.importorskip('numpy')
+    d = pkarray.new_double([1.5, -2])
+    n = pkarray.to_numpy(d)
+    assert np.float64 == n.dtype
+    n[0] = 3
+    assert 3 == d[0], \
+        'to_numpy should not copy'
+    i = pkarray.from_numpy(np.arange(3, dtype=np.int32))
+    assert pkarray.new_int32([0, 1, 2]) == i
+
+
+def test_mapped(monkeypatch):
+    from pykern import pkunit
+
+    monkeypatch.setattr(pkarray, 'MAPPED_GROW_BYTES', 64)
+    fn = pkunit.empty_work_dir().join('m.pka')
+    with pkarray.open_mapped(fn, 'a', row_shape=(3,)) as w:
+        assert 0 == len(w[:]), \
+            'empty array should have an empty slice'
+        w.append((1, 2, 3))
+        assert [] == w[1:1].tolist()
+        r = pkarray.open_mapped(fn)
+        v = r[:]
+        assert [[1, 2, 3]] == v.tolist()
+        w.extend(range(30))
+        assert 11 == len(r), \
+            'reader should see rows appended after it mapped'
+        assert [27, 28, 29] == r[-1].tolist(), \
+            'reader should remap to see grown file'
+        assert (2, 3) == r[1:3].shape
+        assert [[1, 2, 3]] == v.tolist(), \
+            'view should survive remap'
+        with pytest.raises(IOError):
+            pkarray.open_mapped(fn, 'a')
+        with pytest.raises(ValueError):
+            w.extend([1, 2])
+        r.close()
+    r = pkarray.open_mapped(fn)
+    assert (11, 3) == r.shape
+    assert pkarray.DOUBLE_TYPECODE == r.typecode
+    with pkarray.open_mapped(fn, 'w', typecode=pkarray.INT64_TYPECODE) as w:
+        assert [27, 28, 29] == r[-1].tolist(), \
+            'reader should keep the replaced file'
+        r.close()
+        w.extend(pkarray.new_int64([5, 6]))
+        w.append(7)
+        w.extend(pkarray.new_uint8([8]))
+        assert 5 == w[0]
+        assert [6, 7, 8] == w[1:].tolist(), \
+            'other typecodes should be converted, not reinterpreted'
+        with pytest.raises(TypeError):
+            w.extend(pkarray.new_double([1.5]))
+    fn.write('not an array' * 10)
+    with pytest.raises(ValueError):
+        pkarray.open_mapped(fn)
+    fn.write('')
+    with pytest.raises(ValueError, match='missing MappedArray header'):
+        pkarray.open_mapped(fn)
+    assert 1 == len(fn.dirpath().listdir()), \
+        'replaced file should not leave temporary files'
+
+
+def test_mapped_numpy():
+    np = pytest.importorskip('numpy')
+    from pykern import pkunit
+
+    fn = pkunit.empty_work_dir().join('m.pka')
+    with pkarray.open_mapped(fn, 'w', row_shape=(2,)) as w:
+        assert (0, 2) == w.to_numpy().shape
+        w.extend(np.arange(4, dtype=np.float32))
+        assert [[0, 1], [2, 3]] == w.to_numpy().tolist()
+
+
+def test_shared():
+    import concurrent.futures
+    import pickle
+
+    a = pkarray.new_shared((2, 3), initializer=range(6))
+    assert (2, 3) == a.shape
+    assert [0, 1, 2, 3, 4, 5] == list(a)
+    assert len(pickle.dumps(a)) < 100, \
+        'pickle should only pass name'
+    with concurrent.futures.ProcessPoolExecutor(1) as p:
+        assert [15, 15] == list(p.map(_sum_shared, [a, a]))
+    b = pickle.loads(pickle.dumps(a))
+    b[0] = 9
+    assert 9 == a[0], \
+        'handles should share elements'
+    a.close()
+    assert 9 == pkarray.attach_shared(b.name)[0], \
+        'segment should exist while referenced'
+    b.close()
+    with pytest.raises(IOError):
+        pkarray.attach_shared(b.name)
+    with pkarray.new_shared(3, pkarray.INT64_TYPECODE, pkarray.new_int64([1, 2, 3])) as i:
+        assert [1, 2, 3] == list(i)
+    with pkarray.new_shared(2, initializer=pkarray.new_int32([1, 2])) as a:
+        assert [1, 2] == list(a), \
+            'other typecodes should be converted, not reinterpreted'
+    with pytest.raises(ValueError):
+        pkarray.new_shared(3, initializer=[1, 2])
+
+
+def test_shared_unlink():
+    import subprocess
+    import sys
+
+    a = pkarray.new_shared(3)
+    subprocess.check_call([
+        sys.executable,
+        '-c',
+        'import os; from pykern import pkarray; a = pkarray.attach_shared({!r}); os._exit(0)'.format(a.name),
+    ])
+    a.close()
+    with pkarray.attach_shared(a.name) as b:
+        assert 3 == len(b), \
+            'reference of process which exited without close should keep the segment'
+        b.unlink()
+        b[0] = 1
+        assert 1 == b[0], \
+            'handle should be valid after unlink'
+        with pytest.raises(IOError):
+            pkarray.attach_shared(a.name)
+
+
+def test_shared_numpy():
+    np = pytest.importorskip('numpy')
+    with pkarray.new_shared((2, 2)) as a:
+        n = a.to_numpy()
+        assert (2, 2) == n.shape
+        n[1, 1] = 3
+        assert 3 == a[3]
+        del n
+
+
+def _sum_shared(value):
+    return sum(value)
@@ -15,6 +15,31 @@ import string
 _VALUE = 1
 
 
+def test_deep_merge():
+    b = Dict(a=Dict(b=1, c=[1]), d=2)
+    pkeq(
+        Dict(a=Dict(b=1, c=[1, 2], e=3), d=2),
+        pkcollections.deep_merge(b, Dict(a=Dict(c=[2], e=3)), list_merge='append'),
+    )
+    pkeq([2], pkcollections.deep_merge(b, dict(a=dict(c=[2]))).a.c)
+    pkeq([3, 2], pkcollections.deep_merge(b, dict(a=dict(c=[3])), 'prepend').a.c)
+    with pkexcept('invalid list_merge'):
+        pkcollections.deep_merge(b, b, list_merge='not-a-mode')
+    # Deeper than the recursion limit
+    b = Dict()
+    n = Dict()
+    x = b
+    y = n
+    for _ in range(5000):
+        x.n = Dict()
+        x = x.n
+        y.n = Dict()
+        y = y.n
+    y.v = 1
+    pkcollections.deep_merge(b, n)
+    pkeq(1, x.v)
+
+
 def test_delattr():
     n = OrderedMapping()
     with pytest.raises(AttributeError):
@@ -71,6 +96,19 @@ def test_dict():
         n['missing key']
 
 
+def test_dotted():
+    d = Dict()
+    s = pkcollections.dotted_setter('a.b.c')
+    s(d, 1)
+    pkeq(1, d.a.b.c)
+    g = pkcollections.dotted_getter('a.b.c')
+    pkeq(1, g(d))
+    pkeq(2, g(Dict(a=dict(b=dict(c=2)))))
+    pkeq(None, pkcollections.dotted_getter(('a', 'x'), None)(d))
+    with pkexcept(KeyError):
+        pkcollections.dotted_getter('a.x')(d)
+
+
 def test_eq():
     assert not OrderedMapping() == None, \
         'OrderedMapping compared to None is false'
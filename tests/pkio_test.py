@@ -11,6 +11,117 @@ import py
 import pytest
 
 
+def test_atomic_batch():
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        with pkio.AtomicBatch(fsync=False) as b:
+            for i in range(3):
+                b.write_text('f{}'.format(i), str(i))
+            pkeq([], glob.glob('f?'))
+        pkeq(['f0', 'f1', 'f2'], sorted(os.listdir('.')))
+        with pytest.raises(ValueError):
+            with pkio.AtomicBatch() as b:
+                b.write_text('f0', 'x')
+                raise ValueError()
+        with pytest.raises(ValueError):
+            with pkio.open_atomic('f1', mode='wb') as f:
+                f.write(b'x')
+                raise ValueError()
+        pkeq(['f0', 'f1', 'f2'], sorted(os.listdir('.')))
+        pkeq('0', pkio.read_text('f0'))
+        pkeq('1', pkio.read_text('f1'))
+
+
+@pytest.mark.parametrize('ext', ['gz', 'bz2', 'xz'])
+def test_compression(ext, monkeypatch):
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        fn = 'f1.txt.' + ext
+        expect = ''.join('line {}\n'.format(i) for i in range(10000))
+        pkio.write_text(fn, expect, level=1)
+        pkeq(expect, pkio.read_text(fn))
+        pkeq(10000, len(list(pkio.iter_lines(fn))))
+        pkeq(expect.encode('ascii'), b''.join(pkio.iter_chunks(fn)))
+        assert expect.encode('ascii') != b''.join(pkio.iter_chunks(fn, decompress=False)), \
+            'When decompress is False, iter_chunks should return compressed bytes'
+        with pkio.open_compressed(fn, mode='wb') as f:
+            f.write(b'abc')
+        pkeq('abc', pkio.read_text(fn))
+        pkio.write_text(fn, expect, level=1)
+        single = py.path.local(fn).read_binary()
+        # Small blocks so data is compressed in concurrent streams
+        monkeypatch.setattr(pkio, '_COMPRESS_BLOCK', 10000)
+        pkio.write_text(fn, expect, atomic=True, level=1, threads=2)
+        assert single != py.path.local(fn).read_binary(), \
+            'When threads > 1, data should be compressed in multiple streams'
+        pkeq(expect, pkio.read_text(fn))
+
+
+def test_copy_and_remove_tree(monkeypatch):
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+    import errno
+
+    with pkunit.save_chdir_work():
+        pkio.mkdir_parent('src/d1/d2')
+        for f in ('src/d1/d2/f1', 'src/f2'):
+            pkio.write_text(f, f)
+        os.symlink('f2', 'src/l1')
+        for m in pkio.COPY_MODES:
+            p = []
+            pkio.copy_tree('src', m, mode=m, threads=2, progress=p.append)
+            pkeq(
+                list(pkio.iter_tree('src', relative=True)),
+                list(pkio.iter_tree(m, relative=True)),
+            )
+            pkeq('src/d1/d2/f1', pkio.read_text(m + '/d1/d2/f1'))
+            pkeq('f2', os.readlink(m + '/l1'))
+            pkeq(3, p[-1].files)
+        pkeq(
+            os.stat('src/f2').st_ino,
+            os.stat('hardlink/f2').st_ino,
+        )
+        # Files in dst which are hardlinks or symlinks must be replaced
+        pkio.mkdir_parent('src2/d1/d2')
+        for f in ('src2/d1/d2/f1', 'src2/l1'):
+            pkio.write_text(f, 'new')
+        pkio.copy_tree('src2', 'hardlink')
+        pkeq('new', pkio.read_text('hardlink/d1/d2/f1'))
+        pkeq('new', pkio.read_text('hardlink/l1'))
+        pkeq(False, os.path.islink('hardlink/l1'))
+        pkeq('src/d1/d2/f1', pkio.read_text('src/d1/d2/f1'))
+        pkeq('src/f2', pkio.read_text('src/f2'))
+        pkio.remove_tree('src2')
+        for m in pkio.COPY_MODES:
+            pkio.remove_tree(m, threads=2)
+        pkeq(['src'], os.listdir('.'))
+        with pytest.raises(OSError):
+            pkio.remove_tree('not-found')
+        pkio.remove_tree('not-found', ignore_errors=True)
+        with pytest.raises(AssertionError):
+            pkio.remove_tree('.')
+        pkio.copy_tree('src', 'partial')
+        pkio.mkdir_parent('partial/bad')
+        pkio.write_text('partial/bad/f3', 'f3')
+        s = os.scandir
+
+        def _scandir(path):
+            if path.endswith('bad'):
+                raise OSError(errno.EACCES, 'unreadable', path)
+            return s(path)
+
+        monkeypatch.setattr(os, 'scandir', _scandir)
+        pkio.remove_tree('partial', ignore_errors=True)
+        pkeq(['bad'], os.listdir('partial'))
+
+
 def test_has_file_extension():
     from pykern.pkunit import pkeq
     from pykern import pkio
@@ -19,6 +130,127 @@ def test_has_file_extension():
     pkeq(True, pkio.has_file_extension(py.path.local('x.abc'), ('abc', 'def')))
 
 
+def test_hash_tree(monkeypatch):
+    import hashlib
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        pkio.mkdir_parent('d1')
+        for f in ('d1/f1', 'f2'):
+            pkio.write_text(f, f)
+            # older than the racy window so it is indexed
+            os.utime(f, (1e9, 1e9))
+        expect = dict((f, hashlib.sha256(f.encode('ascii')).hexdigest()) for f in ('d1/f1', 'f2'))
+        pkeq(expect, pkio.hash_tree('.', threads=2))
+        pkeq(expect['f2'], pkio.hash_file('f2'))
+        assert os.path.exists(pkio.HASH_INDEX_BASENAME), \
+            'When hash_tree is called, index should be written'
+        pkio.write_text('f2', 'changed')
+        expect['f2'] = hashlib.sha256(b'changed').hexdigest()
+        pkeq(expect, pkio.hash_tree('.'))
+        os.utime('f2', (1e9, 1e9))
+        pkio.hash_tree('.')
+        calls = []
+        h = pkio.hash_file
+        monkeypatch.setattr(pkio, 'hash_file', lambda *a: calls.append(a[0]) or h(*a))
+        pkeq(['d1/f1'], list(pkio.hash_tree('.', file_re='^d1/')))
+        pkeq(expect, pkio.hash_tree('.'))
+        pkeq([], calls, 'unchanged files should not be read after hash_tree with file_re')
+
+
+def test_iter_chunks_and_lines(monkeypatch):
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        pkio.write_text('f1', 'line1\nline2\nend')
+        pkeq(['line1\n', 'line2\n', 'end'], list(pkio.iter_lines('f1', chunk_size=2)))
+        sizes = []
+        o = pkio.open_text
+        monkeypatch.setattr(
+            pkio,
+            'open_text',
+            lambda f, chunk_size=None: sizes.append(chunk_size) or o(f, chunk_size),
+        )
+        pkeq(3, len(list(pkio.iter_lines('f1'))))
+        pkeq([pkio.cfg.chunk_size], sizes)
+        pkeq([b'line1', b'\nline', b'2\nend'], list(pkio.iter_chunks('f1', chunk_size=5)))
+        pkeq([], list(pkio.iter_chunks(pkio.write_text('f2', ''))))
+
+
+def test_iter_tree():
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work() as d:
+        for f in ('d1/d7', 'd1.x', 'd2/d3'):
+            pkio.mkdir_parent(f)
+        for f in ('d1/d7/f1', 'd1.x/f2', 'd1-f3', 'd2/d3/f4'):
+            pkio.write_text(f, '')
+        res = list(pkio.iter_tree('.'))
+        pkeq(sorted(res), res)
+        pkeq([str(d.join(f)) for f in ('d1-f3', 'd1.x/f2', 'd1/d7/f1', 'd2/d3/f4')], res)
+        pkeq(
+            [str(d.join('d1-f3'))],
+            list(pkio.iter_tree('.', file_re='^d1', prune_re=r'^d1(\.x)?$')),
+        )
+        pkeq([str(p) for p in pkio.walk_tree('.')], res)
+
+
+@pytest.mark.parametrize('force_poll', [False, True])
+def test_iter_watch(force_poll):
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work() as d:
+        g = pkio.iter_watch(d, timeout=0.2, poll=0.05, force_poll=force_poll)
+        pkeq([], next(g))
+        pkio.mkdir_parent('d1')
+        pkio.write_text('d1/f1', 'a')
+        pkio.write_text('f2', 'b')
+        pkeq(
+            sorted([(pkio.WATCH_CREATE, 'd1/f1'), (pkio.WATCH_CREATE, 'f2')]),
+            sorted(next(g)),
+        )
+        os.remove('f2')
+        pkeq([(pkio.WATCH_DELETE, 'f2')], next(g))
+        os.rename('d1', '../d1-' + str(force_poll))
+        pkeq([(pkio.WATCH_DELETE, 'd1/f1' if force_poll else 'd1')], next(g))
+        os.rename('../d1-' + str(force_poll), 'd2')
+        pkeq(
+            [(pkio.WATCH_CREATE, 'd2/f1')] if force_poll
+            else [(pkio.WATCH_CREATE, 'd2'), (pkio.WATCH_CREATE, 'd2/f1')],
+            next(g),
+        )
+        g.close()
+
+
+def test_open_mmap():
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern import pkjson
+    from pykern import pkyaml
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        pkio.write_text('f1.json', '{"a": [1, 2]}')
+        with pkio.open_mmap('f1.json') as m:
+            pkeq(b'{"a"', m[:4])
+            pkeq([1, 2], pkjson.load_any(m).a)
+        with pkio.open_mmap(pkio.write_text('f2', '')) as m:
+            pkeq(0, len(m))
+            pkeq(b'', m[:4])
+            pkeq(0, memoryview(m).nbytes)
+            pkeq(b'', m.read())
+        with pkio.open_mmap('f2') as m:
+            pkeq(None, pkyaml.load_file(m))
+
+
 def test_py_path():
     from pykern import pkunit
     from pykern import pkio
@@ -60,6 +292,24 @@ def test_save_chdir():
             'When save_chdir given non-existent dir and mkdir=True, should pass'
 
 
+def test_scan_tree():
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        for f in ('d1/d7', 'd2/d3', 'd4/d5/d6'):
+            pkio.mkdir_parent(f)
+        for f in ('d1/d7/f1', 'd4/d5/f2', 'd2/d3/f3'):
+            pkio.write_text(f, f)
+        pkeq(list(pkio.iter_tree('.')), list(pkio.scan_tree('.', threads=3)))
+        res = list(pkio.scan_tree('.', prune_re='^d4', relative=True, want_stat=True))
+        pkeq(['d1/d7/f1', 'd2/d3/f3'], [p for p, _ in res])
+        pkeq([8, 8], [s.st_size for _, s in res])
+        pkeq(pkio.walk_tree('.'), pkio.walk_tree('.', threads=2))
+        pkeq(pkio.sorted_glob('d*/d*'), pkio.sorted_glob('d*/d*', threads=2))
+
+
 def test_unchecked_remove():
     """Also tests mkdir_parent"""
     from pykern import pkunit
@@ -125,3 +375,12 @@ def test_write_text():
             'When write_text is called, it should write "something"'
     assert expect_content == pkio.read_text(str(expect_res)), \
         'When read_text, it should read "something"'
+    pkio.write_text(expect_res, 'atomic', atomic=True)
+    assert 'atomic' == pkio.read_text(expect_res), \
+        'When write_text is atomic, it should replace contents'
+    assert [expect_res] == pkio.sorted_glob(d.join('*')), \
+        'When write_text is atomic, temporary file should be removed'
+    os.chmod(str(expect_res), 0o600)
+    pkio.write_text(expect_res, 'mode', atomic=True)
+    assert 0o600 == os.stat(str(expect_res)).st_mode & 0o777, \
+        'When write_text is atomic, mode of existing file should be kept'
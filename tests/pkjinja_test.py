@@ -29,3 +29,61 @@ def test_render_resource():
             'render_resource should return string even when writing to file'
         assert expect == pkio.read_text(out), \
             'With out, render_resource should write file'
+
+
+def test_render_file_cache():
+    import jinja2
+
+    with pkunit.save_chdir_work():
+        pkio.write_text('t.jinja', '{{ a }}\n')
+        assert '1\n' == pkjinja.render_file('t.jinja', dict(a=1))
+        assert '2\n' == pkjinja.render_file('t.jinja', dict(a=2)), \
+            'cached template should render new context'
+        pkio.write_text('t.jinja', 'x{{ a }}\n')
+        s = os.stat('t.jinja')
+        os.utime('t.jinja', (s.st_atime, s.st_mtime + 10))
+        assert 'x3\n' == pkjinja.render_file('t.jinja', dict(a=3)), \
+            'template should be recompiled when mtime changes'
+        with pytest.raises(jinja2.UndefinedError):
+            pkjinja.render_file('t.jinja', dict(), strict_undefined=True)
+        assert all(e.bytecode_cache is None for e in pkjinja._environments.values()), \
+            'bytecode cache should only be used when bytecode_cache_dir is set'
+
+
+def test_render_file_stream():
+    with pkunit.save_chdir_work():
+        pkio.write_text('t.jinja', '{% for i in range(n) %}\n{{ i }}\n{% endfor %}\n')
+        expect = pkjinja.render_file('t.jinja', dict(n=1000))
+        for out in 'out', 'out.gz':
+            pkjinja.render_file('t.jinja', dict(n=1000), output=out, stream=True)
+            assert expect == pkio.read_text(out), \
+                '{}: streamed output should match render'.format(out)
+
+
+def test_render_tree(monkeypatch):
+    with pkunit.save_chdir_work() as d:
+        monkeypatch.setattr(pkjinja.cfg, 'bytecode_cache_dir', str(d.join('bc')))
+        monkeypatch.setattr(pkjinja, '_environments', {})
+        for i in range(pkjinja.BATCH_PARALLEL_MIN + 1):
+            pkio.write_text(
+                pkio.mkdir_parent('src/d{}'.format(i)).join('t.jinja'),
+                '{{ a }}' + str(i),
+            )
+        pkio.write_text('src/dot-x.jinja', '{{ b }}')
+        out = pkjinja.render_tree(
+            'src',
+            dict(a=1, b=2),
+            'dst',
+            dst_name=lambda p: p.replace('dot-', '.'),
+            processes=2,
+        )
+        assert len(out) == pkjinja.BATCH_PARALLEL_MIN + 2
+        assert '13' == pkio.read_text('dst/d3/t')
+        assert '2' == pkio.read_text('dst/.x')
+        assert len(glob.glob('bc/*')) == pkjinja.BATCH_PARALLEL_MIN + 2, \
+            'templates should be in bytecode cache for workers which are not forked'
+        with pytest.raises(pkjinja.BatchError) as e:
+            pkjinja.render_tree('src', dict(a=1), 'dst2', strict_undefined=True, processes=2)
+        assert 1 == len(e.value.errors)
+        assert '10' == pkio.read_text('dst2/d0/t'), \
+            'other jobs should run when one fails'
@@ -8,6 +8,169 @@ from __future__ import absolute_import, division, print_function
 import pytest
 
 
+def test_arrays():
+    import array
+    import datetime
+    from pykern import pkjson
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+
+    d = pkunit.empty_work_dir()
+    v = dict(
+        a=array.array('d', [1.5, -3e-7]),
+        i=array.array('h', [1, -2]),
+        t=datetime.datetime(2020, 1, 2, 3, 4, 5),
+    )
+    pkeq(
+        dict(a=[1.5, -3e-7], i=[1, -2], t='2020-01-02T03:04:05'),
+        pkjson.load_any(pkjson.dump_pretty(v, pretty=False)),
+    )
+    for m in 'base64', 'sidecar':
+        fn = d.join(m + '.json')
+        j = pkjson.dump_pretty(v, filename=fn, arrays=m)
+        pkeq(m == 'sidecar', d.join(m + '.json.0.bin').check())
+        r = pkjson.load_any(fn, arrays=True)
+        pkeq(list(v['a']), list(r.a))
+        pkeq(list(v['i']), list(r.i))
+        pkeq([pkjson.ARRAY_KEY], list(pkjson.load_any(j).a.keys()))
+    np = pytest.importorskip('numpy')
+    v = dict(m=np.arange(6, dtype=np.int32).reshape(2, 3), s=np.float32(1.5))
+    r = pkjson.load_any(pkjson.dump_pretty(v, arrays='base64'), arrays=True)
+    pkeq(np.int32, r.m.dtype)
+    pkeq(v['m'].tolist(), r.m.tolist())
+    pkeq(1.5, r.s)
+    pkeq(
+        dict(m=[[0, 1, 2], [3, 4, 5]], s=1.5),
+        pkjson.load_any(pkjson.dump_pretty(v, pretty=False)),
+    )
+
+
+@pytest.mark.parametrize('backend', ('json', 'orjson', 'rapidjson', 'ujson'))
+def test_backend(backend, monkeypatch):
+    pytest.importorskip(backend)
+    import array
+    import math
+    from pykern import pkcollections
+    from pykern import pkjson
+    from pykern.pkunit import pkeq
+
+    monkeypatch.setattr(pkjson.cfg, 'backend', backend)
+    monkeypatch.setattr(pkjson, '_backend_cache', None)
+    pkeq(backend, pkjson._backend().name)
+    d = pkcollections.Dict(a=[1, dict(b=[dict(c=u'\u00e9/')])], keys=None)
+    j = pkjson.load_any(pkjson.dump_pretty(d, pretty=False))
+    pkeq(d, j)
+    pkeq(pkcollections.Dict, type(j.a[1].b[0]))
+    # Fall back to json for values fast libraries reject
+    pkeq(1 << 70, pkjson.load_any(str(1 << 70)))
+    pkeq({'1': 2}, pkjson.load_any(pkjson.dump_pretty({1: 2}, pretty=False)))
+    pkeq(
+        '{"a": 1}' if backend == 'json' else '{"a":1}',
+        pkjson.dump_pretty(dict(a=1), pretty=False),
+    )
+    # NaN and Infinity must not be lost (orjson writes null)
+    for v in (float('nan'), dict(a=float('inf')), [1, array.array('d', [float('-inf')])]):
+        j = pkjson.dump_pretty(v, pretty=False)
+        assert 'null' not in j, \
+            '{}: non-finite float should not be written as null'.format(j)
+    assert math.isnan(pkjson.load_any(pkjson.dump_pretty(float('nan'), pretty=False)))
+    pkeq(float('inf'), pkjson.load_any(pkjson.dump_pretty(dict(a=float('inf')), pretty=False)).a)
+    pkeq(
+        '{\n    "a": "\\u00e9",\n    "b": 1.5\n}\n',
+        pkjson.dump_pretty(dict(b=1.5, a=u'\u00e9')),
+    )
+
+
+def test_canonical():
+    import hashlib
+    from pykern import pkcollections
+    from pykern import pkjson
+    from pykern.pkunit import pkeq
+
+    v = pkcollections.Dict(b=[2.0, -0.0, 1.5, None, u'\u00e9'], a=dict(c=(True, {}, [[]])))
+    c = u'{"a":{"c":[true,{},[[]]]},"b":[2,0,1.5,null,"\u00e9"]}'
+    pkeq(c, pkjson.canonical_dumps(v))
+    pkeq(hashlib.sha256(c.encode('utf-8')).hexdigest(), pkjson.canonical_hash(v))
+    pkeq(
+        pkjson.canonical_hash(dict(x=1, y=[1, 2])),
+        pkjson.canonical_hash(dict(y=[1.0, 2], x=1.0)),
+    )
+    pkeq(
+        '{"a":1,"b":{"c":[2]}}',
+        pkjson.canonical_dumps(
+            pkcollections.OrderedMapping(b=pkcollections.OrderedMapping(c=[2.0]), a=1),
+        ),
+    )
+    with pytest.raises(ValueError):
+        pkjson.canonical_dumps([float('nan')])
+    with pytest.raises(TypeError):
+        pkjson.canonical_dumps({1: 2})
+
+
+def test_iter_load():
+    import io
+    import json
+    from pykern import pkcollections
+    from pykern import pkjson
+    from pykern.pkunit import pkeq, pkexcept
+
+    d = pkcollections.Dict(a=[1, -1.5e-3, dict(b=u'\u00e9')], c=None, d='x')
+    j = json.dumps(d, indent=2)
+    for n in (1, 3, 1000):
+        pkeq(list(d.items()), list(pkjson.iter_load(io.BytesIO(j.encode('utf-8')), chunk_size=n)))
+    # Raw UTF-8 split across reads
+    pkeq(
+        [u'\u00e9\u20ac', 1],
+        list(pkjson.iter_load(io.BytesIO(u'["\u00e9\u20ac", 1]'.encode('utf-8')), chunk_size=1)),
+    )
+    r = list(pkjson.iter_load(io.StringIO(u'[{"a": 1}, 2]'), chunk_size=2))
+    pkeq([{'a': 1}, 2], r)
+    pkeq(1, r[0].a)
+    pkeq([], list(pkjson.iter_load('[]')))
+    with pkexcept('top-level value'):
+        list(pkjson.iter_load('1'))
+    with pkexcept('expecting ","'):
+        list(pkjson.iter_load('[1 2]'))
+
+
+def test_lines(monkeypatch):
+    import time
+    from pykern import pkjson
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+
+    fn = pkunit.empty_work_dir().join('x.ndjson')
+    with pkjson.LinesAppender(fn, flush_lines=3) as a:
+        for i in range(10):
+            a.append(dict(i=i))
+            if i == 4:
+                pkeq(3, len(fn.readlines()))
+    pkeq('{"i":0}\n', fn.readlines()[0])
+    expect = [dict(i=i) for i in range(10)]
+    r = list(pkjson.iter_lines(fn))
+    pkeq(expect, r)
+    pkeq(9, r[9].i)
+    monkeypatch.setattr(pkjson, 'LINES_PARALLEL_MIN_CHUNK', 10)
+    pkeq(expect, pkjson.load_lines_parallel(fn, processes=3))
+    with pkjson.LinesAppender(fn, flush_interval=10) as a:
+        a.append(dict(i=10))
+        pkeq(10, len(fn.readlines()), 'lines should be buffered until flush_interval')
+        a.flush()
+        pkeq(11, len(fn.readlines()))
+    with pkjson.LinesAppender(fn, flush_interval=0.05) as a:
+        for i in 12, 13:
+            a.append(dict(i=i))
+            for _ in range(100):
+                if len(fn.readlines()) == i:
+                    break
+                time.sleep(0.05)
+            pkeq(i, len(fn.readlines()), 'idle lines should be flushed by timer')
+            if i == 12:
+                t = a._thread
+        assert t is a._thread, \
+            'one thread should flush all batches'
+
+
 def test_load_any():
     """Validate json_load_any()"""
     import json
@@ -17,3 +180,17 @@ def test_load_any():
     j = json.dumps(['a', 'b'])
     j2 = pkjson.load_any(j)
     pkeq('a', j2[0])
+    pkeq(['a', 'b'], pkjson.load_any(memoryview(j.encode('utf-8'))))
+
+
+def test_dump_pretty():
+    from pykern import pkjson
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+
+    d = pkunit.empty_work_dir()
+    fn = d.join('x.json')
+    expect = pkjson.dump_pretty(dict(b=[1], a=1), filename=fn, atomic=True)
+    pkeq('{\n    "a": 1,\n    "b": [\n        1\n    ]\n}\n', expect)
+    pkeq(expect, fn.read())
+    pkeq([fn], d.listdir())
@@ -36,3 +36,34 @@ def test_filename():
         pkresource.filename('somefile', pkresource)
     assert pkresource.filename('somefile', t1.somefile), \
         'Given any object, should fine resource in root package of that object'
+
+
+def test_filename_package_name():
+    n = pkresource.filename('test.yml', pkresource)
+    assert n == pkresource.filename('test.yml', 'pykern.pkio'), \
+        'A package name should resolve to the same root package'
+    assert n == pkresource.filename('test.yml', 'pykern'), \
+        'Cached path should be returned'
+    with pytest.raises(IOError):
+        pkresource.filename('not-found', 'pykern')
+
+
+def test_read_zip(monkeypatch):
+    import sys
+    import zipfile
+
+    z = str(pkunit.empty_work_dir().join('r.zip'))
+    with zipfile.ZipFile(z, 'w') as f:
+        f.writestr('pkresource_zip/__init__.py', '')
+        f.writestr('pkresource_zip/package_data/s', 'stored', zipfile.ZIP_STORED)
+        f.writestr('pkresource_zip/package_data/d', 'd' * 100, zipfile.ZIP_DEFLATED)
+    monkeypatch.syspath_prepend(z)
+    monkeypatch.delitem(sys.modules, 'pkresource_zip', raising=False)
+    for n, expect in ('s', b'stored'), ('d', b'd' * 100):
+        assert expect == pkresource.read_bytes(n, 'pkresource_zip')
+        assert expect == bytes(pkresource.read_memoryview(n, 'pkresource_zip'))
+        with pkresource.open_binary(n, 'pkresource_zip') as f:
+            assert expect == f.read()
+    with pytest.raises(IOError):
+        pkresource.read_bytes('not-found', 'pkresource_zip')
+    assert b'f1' in bytes(pkresource.read_memoryview('test.yml', pkresource))
@@ -14,12 +14,58 @@ import py
 from pykern import pkunit
 from pykern import pkyaml
 
+
+def test_iter_load():
+    """Test documents are yielded one at a time"""
+    import io
+
+    y = pkyaml.iter_load(io.StringIO(u'a: 1\n---\n[b]\n---\n'))
+    assert 1 == next(y).a
+    assert ['b'] == next(y)
+    with pytest.raises(StopIteration):
+        next(y)
+
+
 def test_load_file():
     """Test values are unicode"""
     y = pkyaml.load_file(pkunit.data_dir().join('conf1.yml'))
     _assert_unicode(y)
 
 
+def test_load_file_cache():
+    """Test cached values are copies and revalidated"""
+    import os
+
+    fn = pkunit.empty_work_dir().join('c.yml')
+    fn.write('a: [1]\n')
+    pkyaml.load_file(fn, cache=True)
+    assert str(fn) not in pkyaml._cache, \
+        'recently modified file should not be cached'
+    os.utime(str(fn), (1e9, 1e9))
+    y = pkyaml.load_file(fn, cache=True)
+    assert str(fn) in pkyaml._cache
+    y.a.append(2)
+    assert [1] == pkyaml.load_file(fn, cache=True).a
+    fn.write('a: [3, 4]\n')
+    s = fn.stat()
+    os.utime(str(fn), (s.atime, s.mtime + 10))
+    assert [3, 4] == pkyaml.load_file(fn, cache=True).a
+
+
+def test_load_file_stream():
+    """Test streams, Dict, and deep nesting"""
+    import io
+    from pykern import pkcollections
+
+    y = pkyaml.load_file(io.StringIO(u'a: &x {b: 1}\nc:\n  <<: *x\n  d: [{e: 2}]\n'))
+    assert isinstance(y.c.d[0], pkcollections.Dict)
+    assert 1 == y.c.b
+    y = pkyaml.load_file(io.StringIO(u'{a: ' * 5000 + u'1' + u'}' * 5000))
+    for _ in range(5000):
+        y = y.a
+    assert 1 == y
+
+
 def test_load_resource():
     """Test file can be read"""
     p1 = pkunit.import_module_from_data_dir('p1')